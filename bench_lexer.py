@@ -0,0 +1,52 @@
+import sys
+import time
+
+import supp
+
+###############################
+# INPUTS
+###############################
+
+SIZES = [64 * 1024, 256 * 1024, 1024 * 1024]
+
+CASES = {
+    'line comment': lambda n: '//' + 'x' * n + '\n',
+    'block comment': lambda n: '/*' + 'x\n' * (n // 2) + '*/',
+    'string literal': lambda n: '"' + 'x' * n + '"',
+    'identifier': lambda n: 'a' * n,
+    'number': lambda n: '1' * n + '.5',
+    'specialchar': lambda n: '@' * n,
+}
+
+
+###############################
+# BENCH
+###############################
+
+def time_lex(text, engine):
+    start = time.perf_counter()
+    _, error = supp.run_from_code(text, engine=engine)
+    elapsed = time.perf_counter() - start
+    if error:
+        raise RuntimeError(error)
+    return elapsed
+
+
+def main(engines=('classic', 'regex')):
+    # Time per MB should stay flat as the input grows; a quadratic scanner
+    # shows up as a ratio that roughly doubles with each size step.
+    print(f"{'case':<16}{'engine':<10}" + ''.join(f'{size // 1024:>10} KB' for size in SIZES) + '   ms/MB ratio')
+    for name, make in CASES.items():
+        for engine in engines:
+            per_mb = []
+            row = f'{name:<16}{engine:<10}'
+            for size in SIZES:
+                elapsed = time_lex(make(size), engine)
+                per_mb.append(elapsed / (size / (1024 * 1024)))
+                row += f'{elapsed * 1000:>10.2f} ms'
+            row += f'   {per_mb[-1] / per_mb[0]:.2f}'
+            print(row)
+
+
+if __name__ == '__main__':
+    main(tuple(sys.argv[1:]) or ('classic', 'regex'))
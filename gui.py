@@ -1,7 +1,155 @@
 
+import queue
+import threading
 import tkinter as tk
-from tkinter import filedialog
+from bisect import bisect_right
+from tkinter import filedialog, ttk
+from tkinter import font as tkfont
 import supp
+import token_stream
+
+OUTPUT_BATCH = 5000  # symbol table lines written between progress updates
+POLL_MS = 50
+SYNC_DELAY_MS = 100  # quiet time after the last edit before the input is re-lexed
+
+# Syntax highlighting: tag per token kind, and how many lines around the view
+# are kept highlighted so short scrolls need no retagging
+HIGHLIGHT_TAGS = {
+    supp.TT_CLASSTYPE: "classtype",
+    supp.TT_ATTRIBUTE: "attribute",
+    supp.TT_RESERVEDWORD: "reservedword",
+    supp.TT_INT: "literal",
+    supp.TT_FLOAT: "literal",
+    supp.TT_STRLITERAL: "literal",
+    supp.TT_SINGLECOMMENT: "comment",
+    supp.TT_STARTCOMMENT: "comment",
+    supp.TT_COMMENT: "comment",
+    supp.TT_ENDCOMMENT: "comment",
+}
+HIGHLIGHT_COLORS = {
+    "classtype": "#8B4513",
+    "attribute": "#1f6f8b",
+    "reservedword": "#0000cd",
+    "literal": "#2e8b57",
+    "comment": "#808080",
+}
+HIGHLIGHT_MARGIN = 100
+ROW_CHARS = 1000  # token rows longer than this are cut short in the output view
+
+class TokenView(tk.Frame):
+    # Shows token rows straight from a token buffer. Only the rows in view are
+    # ever put into the Text widget, and their text is built as they scroll in,
+    # so the cost of drawing does not grow with the number of tokens.
+    def __init__(self, master, font, **options):
+        super().__init__(master, **options)
+        self.tokens = []
+        self.messages = []  # plain lines shown after the tokens
+        self.top = 0
+        self.rows = 1
+        self.marked = None
+
+        self.text = tk.Text(self, wrap="none", height=15, width=40, state=tk.DISABLED, bg="white", fg="black",
+                            font=font)
+        self.text.tag_configure("marked", background="#ffff99")
+        self.text.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        self.linespace = tkfont.Font(font=self.text.cget("font")).metrics("linespace")
+        self.text.bind("<Configure>", self.on_resize)
+        self.text.bind("<MouseWheel>", self.on_wheel)
+        self.text.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.text.bind("<Button-5>", lambda event: self.scroll(3))
+        self.text.bind("<Up>", lambda event: self.scroll(-1))
+        self.text.bind("<Down>", lambda event: self.scroll(1))
+        self.text.bind("<Prior>", lambda event: self.scroll(-self.rows))
+        self.text.bind("<Next>", lambda event: self.scroll(self.rows))
+
+    def __len__(self):
+        return len(self.tokens) + len(self.messages)
+
+    def row(self, index):
+        # Exactly one line per row: a multi-line value is shown escaped rather
+        # than split the way Token.__repr__ splits it, and very long rows are cut
+        if index < len(self.tokens):
+            token = self.tokens[index]
+            if token.value is not None and '\n' in token.value:
+                row = f"{supp.TOKEN_LABELS[token.kind]}{token.value!r}"
+            else:
+                row = f"{token}"
+        else:
+            row = self.messages[index - len(self.tokens)]
+        return row if len(row) <= ROW_CHARS else row[:ROW_CHARS] + "..."
+
+    def set_tokens(self, tokens):
+        self.tokens = tokens
+        self.messages = []
+        self.top = 0
+        self.marked = None
+        self.render()
+
+    def add_message(self, message):
+        self.messages.extend(message.splitlines())
+        self.render()
+
+    def clear(self):
+        self.set_tokens([])
+
+    def render(self):
+        count = len(self)
+        self.top = max(0, min(self.top, count - self.rows))
+        bottom = min(self.top + self.rows, count)
+
+        self.text.config(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(self.row(index) for index in range(self.top, bottom)))
+        if self.marked is not None and self.top <= self.marked < bottom:
+            line = self.marked - self.top + 1
+            self.text.tag_add("marked", f"{line}.0", f"{line}.end")
+        self.text.config(state=tk.DISABLED)
+
+        if count:
+            self.scrollbar.set(self.top / count, bottom / count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, rows):
+        self.top += rows
+        self.render()
+        return "break"
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top = int(float(amount) * len(self))
+            self.render()
+        else:
+            self.scroll(int(amount) * (self.rows if unit == "pages" else 1))
+
+    def on_wheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def on_resize(self, event):
+        self.rows = max(1, event.height // self.linespace)
+        self.render()
+
+    def jump_to_index(self, index):
+        # Bring token `index` to the top of the view and mark it
+        if not 0 <= index < len(self.tokens):
+            return False
+        self.top = index
+        self.marked = index
+        self.render()
+        return True
+
+    def jump_to_offset(self, offset):
+        # Jump to the token covering source offset `offset`, or the next one after it
+        ends = getattr(self.tokens, "ends", None)
+        if ends is None:
+            ends = [token.end for token in self.tokens]
+        return self.jump_to_index(bisect_right(ends, offset))
+
 
 class LexerApp:
     def __init__(self, root):
@@ -29,13 +177,59 @@ class LexerApp:
                                   font=('Franklin Gothic Book', 10))
         self.input_text.grid(row=2, column=0, padx=10, pady=5, sticky="nsew")
 
+        # Tokens are kept up to date as the input is edited. The lexer is updated
+        # on a background thread once typing pauses; `edits` counts edits to the
+        # input box and `synced_edits` is the count the lexer's text matches.
+        self.incremental = supp.IncrementalLexer(self.input_text.get("1.0", tk.END))
+        self.input_text.bind("<<Modified>>", self.on_input_modified)
+        self.edits = 0
+        self.synced_edits = 0
+        self.sync_after = None
+        self.syncer = None
+        self.sync_wanted = False
+        self.synced = queue.Queue()
+
+        # Only the offsets in self.highlighted (lo, hi) are known to carry the
+        # right tags; text outside it is retagged when it scrolls into view.
+        for tag, color in HIGHLIGHT_COLORS.items():
+            self.input_text.tag_configure(tag, foreground=color)
+        self.highlighted = None
+        self.highlight_pending = False
+        self.input_text.config(yscrollcommand=self.on_input_scrolled)
+
+        # Text that Tk inserted or deleted since the last sync, as (lo, hi)
+        # offsets. Tk moves tags along with the text around an edit but the
+        # inserted text itself has to be retagged, and it can be larger than
+        # what a diff of the old and new text reports.
+        self.dirty = None
+        self.input_command = self.input_text._w + "_widget"
+        note_command = root.register(self.note_input_edit)
+        root.tk.call("rename", self.input_text._w, self.input_command)
+        root.tk.call("proc", self.input_text._w, "args",
+                     f"if {{[lindex $args 0] in {{insert delete replace}}}} {{{note_command} {{*}}$args}}\n"
+                     f"uplevel 1 [list {self.input_command} {{*}}$args]")
+
         # Output Terminal
         self.output_label = tk.Label(root, text="Output", font=('Franklin Gothic Demi Cond', 12), bg=self.bg_color)
         self.output_label.grid(row=1, column=1, sticky='n')
 
-        self.output_text = tk.Text(root, wrap="word", height=15, width=40, state=tk.DISABLED, bg="white", fg="black",
-                                   font=('Franklin Gothic Book', 10))
-        self.output_text.grid(row=2, column=1, padx=10, pady=5, sticky="nsew")
+        self.output_frame = tk.Frame(root, bg=self.bg_color)
+        self.output_frame.grid(row=2, column=1, padx=10, pady=5, sticky="nsew")
+        self.output_frame.rowconfigure(1, weight=1)
+        self.output_frame.columnconfigure(0, weight=1)
+
+        self.output_view = TokenView(self.output_frame, font=('Franklin Gothic Book', 10))
+        self.output_view.grid(row=1, column=0, columnspan=3, sticky="nsew")
+
+        # Jump to a token by index or by source offset
+        self.jump_entry = tk.Entry(self.output_frame, width=10, font=('Franklin Gothic Book', 10))
+        self.jump_entry.grid(row=0, column=0, pady=(0, 5), sticky='ew')
+        self.jump_index_button = tk.Button(self.output_frame, text="Token #", command=self.jump_to_index,
+                                           font=('Franklin Gothic Book', 10))
+        self.jump_index_button.grid(row=0, column=1, pady=(0, 5), padx=(5, 0))
+        self.jump_offset_button = tk.Button(self.output_frame, text="Offset", command=self.jump_to_offset,
+                                            font=('Franklin Gothic Book', 10))
+        self.jump_offset_button.grid(row=0, column=2, pady=(0, 5), padx=(5, 0))
 
         # Buttons
         self.run_button = tk.Button(root, text="Run", command=self.run_lexer, bg=self.button_color_run,
@@ -46,36 +240,305 @@ class LexerApp:
                                             bg=self.button_color_select, font=('Franklin Gothic Book', 10))
         self.select_file_button.grid(row=3, column=1, pady=5, padx=(5, 10), sticky='ew')
 
+        # Progress of a run, and a way to stop it
+        self.progress = ttk.Progressbar(root, mode='determinate')
+        self.progress.grid(row=4, column=0, pady=(0, 10), padx=(10, 5), sticky='ew')
+
+        self.cancel_button = tk.Button(root, text="Cancel", command=self.cancel_run, state=tk.DISABLED,
+                                       font=('Franklin Gothic Book', 10))
+        self.cancel_button.grid(row=4, column=1, pady=(0, 10), padx=(5, 10), sticky='ew')
+
+        # Lexing runs on a worker thread that posts its output through this queue
+        self.lex_lock = threading.Lock()
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.worker = None
+
         # row and column expansion
         root.rowconfigure(2, weight=1)
         root.columnconfigure(0, weight=1)
         root.columnconfigure(1, weight=1)
 
+    def on_input_modified(self, event=None):
+        # Debounced: a burst of keystrokes, or a whole file inserted, is lexed once
+        if self.input_text.edit_modified():
+            self.input_text.edit_modified(False)
+            if self.sync_after is not None:
+                self.root.after_cancel(self.sync_after)
+            self.sync_after = self.root.after(SYNC_DELAY_MS, self.sync_input)
+
+    def sync_input(self):
+        # Hand the current text to a background update of the lexer. While one is
+        # in flight, or a run holds the lexer, another is started when it ends.
+        self.sync_after = None
+        if self.syncer is not None or self.worker is not None:
+            self.sync_wanted = True
+            return
+        self.sync_wanted = False
+        dirty, self.dirty = self.dirty, None
+        self.syncer = threading.Thread(target=self.sync_worker,
+                                       args=(self.input_text.get("1.0", tk.END), dirty, self.edits), daemon=True)
+        self.syncer.start()
+        self.root.after(POLL_MS, self.poll_sync)
+
+    def sync_worker(self, text, dirty, edits):
+        # Runs off the Tk thread, like lex_worker
+        with self.lex_lock:
+            old_length = len(self.incremental.text)
+            first, removed, inserted = self.incremental.update(text)
+            delta = len(self.incremental.text) - old_length
+        self.synced.put((first, inserted, delta, dirty, edits))
+
+    def poll_sync(self):
+        try:
+            first, inserted, delta, dirty, edits = self.synced.get_nowait()
+        except queue.Empty:
+            self.root.after(POLL_MS, self.poll_sync)
+            return
+        self.syncer = None
+        self.synced_edits = edits
+
+        # Tags can only be moved along when the input still holds the text that
+        # was lexed; otherwise the view is retagged once the next sync lands
+        if edits == self.edits and self.lex_lock.acquire(blocking=False):
+            try:
+                self.highlight_edit(first, inserted, delta, dirty)
+            finally:
+                self.lex_lock.release()
+        else:
+            self.highlighted = None
+        self.highlight_visible()
+
+        if self.sync_wanted:
+            self.sync_wanted = False
+            self.sync_input()
+
+    def note_input_edit(self, *args):
+        # Called from Tcl just before an insert, delete or replace runs on the input box
+        self.edits += 1
+        try:
+            if args[0] == "insert":
+                self.note_inserted(self.input_offset(args[1]), len(''.join(args[2::2])))
+            elif args[0] == "delete":
+                offsets = [self.input_offset(index) for index in args[1:]]
+                self.note_deleted(min(offsets), max(offsets) if len(offsets) > 1 else offsets[0] + 1)
+            else:
+                start, end = self.input_offset(args[1]), self.input_offset(args[2])
+                self.note_deleted(start, end)
+                self.note_inserted(start, len(''.join(args[3::2])))
+        except (tk.TclError, IndexError):
+            pass  # a bad index: the command itself fails and changes nothing
+
+    def input_offset(self, index):
+        # Offset of a Tk index, clamped to the last character as Tk clamps edits
+        count = self.root.tk.call(self.input_command, "count", "-chars", "1.0", index)
+        last = self.root.tk.call(self.input_command, "count", "-chars", "1.0", "end-1c")
+        return min(count or 0, last or 0)
+
+    def note_inserted(self, at, length):
+        lo, hi = self.dirty or (at, at)
+        lo, hi = (lo if lo < at else lo + length), (hi if hi < at else hi + length)
+        self.dirty = (min(lo, at), max(hi, at + length))
+
+    def note_deleted(self, start, end):
+        def moved(offset):
+            return offset if offset <= start else max(start, offset - (end - start))
+        lo, hi = self.dirty or (start, start)
+        self.dirty = (min(moved(lo), start), max(moved(hi), start))
+
+    ###############################
+    # HIGHLIGHTING
+    ###############################
+
+    def on_input_scrolled(self, first, last):
+        # Called by Tk whenever the view moves; retag once things settle
+        if not self.highlight_pending:
+            self.highlight_pending = True
+            self.root.after_idle(self.highlight_visible)
+
+    def highlight_edit(self, first, inserted, delta, dirty):
+        # Only the text Tk inserted (`dirty`) and the span between the last
+        # unchanged token before the edit and the first one after it need new tags.
+        lexer = self.incremental
+        changed_start = lexer.end(first - 1) if first else 0
+        changed_end = lexer.start(first + inserted) if first + inserted < len(lexer) else len(lexer.text)
+        if dirty is not None:
+            changed_start = min(changed_start, dirty[0])
+            changed_end = min(max(changed_end, dirty[1]), len(lexer.text))
+
+        if self.highlighted is not None:
+            lo, hi = self.highlighted
+            if changed_end - delta <= lo:
+                lo, hi = lo + delta, hi + delta
+            elif changed_start < hi:
+                lo, hi = min(lo, changed_start), max(hi + delta, changed_start)
+            self.highlighted = (lo, hi)
+            if max(changed_start, lo) < min(changed_end, hi):
+                self.retag(max(changed_start, lo), min(changed_end, hi))
+
+    def highlight_visible(self):
+        # Tag whatever part of the visible lines (plus a margin) is not tagged yet
+        self.highlight_pending = False
+        if self.synced_edits != self.edits:
+            return  # the lexer is behind the input; the pending sync refreshes the view
+        if not self.lex_lock.acquire(blocking=False):
+            return  # the run in progress refreshes the view when it ends
+        try:
+            top = int(self.input_text.index("@0,0").split('.')[0])
+            bottom = int(self.input_text.index(f"@0,{self.input_text.winfo_height()}").split('.')[0])
+            lo = self.line_offset(max(1, top - HIGHLIGHT_MARGIN))
+            hi = self.line_offset(bottom + HIGHLIGHT_MARGIN + 1)
+
+            if self.highlighted is None or hi < self.highlighted[0] or lo > self.highlighted[1]:
+                self.retag(lo, hi)
+                self.highlighted = (lo, hi)
+                return
+            tagged_lo, tagged_hi = self.highlighted
+            if lo < tagged_lo:
+                self.retag(lo, tagged_lo)
+            if hi > tagged_hi:
+                self.retag(tagged_hi, hi)
+            self.highlighted = (min(lo, tagged_lo), max(hi, tagged_hi))
+        finally:
+            self.lex_lock.release()
+
+    def line_offset(self, line):
+        # Character offset of the start of `line`, clamped to the end of the text
+        if line > int(self.input_text.index(tk.END).split('.')[0]):
+            return len(self.incremental.text)
+        count = self.input_text.count("1.0", f"{line}.0", "chars")
+        if not count:
+            return 0
+        return count if isinstance(count, int) else count[0]
+
+    def retag(self, lo, hi):
+        # Replace the highlighting tags on text[lo:hi] using the token spans
+        lexer = self.incremental
+        text = lexer.text
+        line = text.count('\n', 0, lo) + 1
+        line_start = text.rfind('\n', 0, lo) + 1
+        position = lo
+
+        def tk_index(offset):
+            nonlocal line, line_start, position
+            newlines = text.count('\n', position, offset)
+            if newlines:
+                line += newlines
+                line_start = text.rfind('\n', position, offset) + 1
+            position = offset
+            return f"{line}.{offset - line_start}"
+
+        lo_index = tk_index(lo)
+        ranges = {tag: [] for tag in HIGHLIGHT_COLORS}
+        index = lexer.index_at(lo + 1)
+        while index < len(lexer) and lexer.start(index) < hi:
+            tag = HIGHLIGHT_TAGS.get(lexer.kinds[index])
+            if tag is not None:
+                ranges[tag] += (tk_index(max(lexer.start(index), lo)), tk_index(min(lexer.end(index), hi)))
+            index += 1
+        hi_index = tk_index(hi)
+
+        for tag, spans in ranges.items():
+            self.input_text.tag_remove(tag, lo_index, hi_index)
+            if spans:
+                self.input_text.tag_add(tag, *spans)
+
     def run_lexer(self):
+        if self.worker is not None:
+            return
         input_code = self.input_text.get("1.0", tk.END)
 
+        self.output_view.clear()
+        self.progress.config(value=0, maximum=1)
+        self.run_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+
+        self.cancelled.clear()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self.lex_worker, args=(input_code, self.results), daemon=True)
+        self.worker.start()
+        self.root.after(POLL_MS, self.poll_results)
+
+    def lex_worker(self, input_code, results):
+        # Runs off the Tk thread: never touches a widget, only posts to `results`
         try:
-            result, error = supp.run_from_code(input_code)
+            with self.lex_lock:
+                self.incremental.update(input_code)
+                result, error = self.incremental.result()
 
             if error:
-                self.output_text.insert(tk.END, f"Error: {error}\n")
+                results.put(('text', f"Error: {error}\n"))
             else:
+                stream_file_path = "symbol_table.bin"
                 output_file_path = "symbol_table.txt"  # Save to symbol_table.txt
-                with open(output_file_path, 'w') as output_file:
-                    for token in result:
-                        output_file.write(f"{token}\n")
+                symbols_file_path = "symbols.txt"
+                # The view builds its rows from the buffer, so it can show them right away
+                results.put(('tokens', result))
 
-                self.output_text.config(state=tk.NORMAL)
-                self.output_text.delete("1.0", tk.END)
+                def report(count):
+                    results.put(('progress', count))
+                    return not self.cancelled.is_set()
 
-                for token in result:
-                    self.output_text.insert(tk.END, f"{token}\n")
-
-                self.output_text.insert(tk.END, f"\nOutput saved to: {output_file_path}\n")
-                self.output_text.config(state=tk.DISABLED)
+                token_stream.write_token_stream(stream_file_path, result)
+                with token_stream.TokenStreamReader(stream_file_path) as reader:
+                    finished = token_stream.export_symbol_table(reader, output_file_path, OUTPUT_BATCH, report)
+                if finished:
+                    token_stream.export_symbols(supp.SymbolTable().add_tokens(result), symbols_file_path)
+                    results.put(('text', f"\nOutput saved to: {output_file_path}\n"))
+                    results.put(('text', f"Symbols saved to: {symbols_file_path}\n"))
 
         except Exception as e:
-            self.output_text.insert(tk.END, f"An error occurred: {str(e)}\n")
+            results.put(('text', f"An error occurred: {str(e)}\n"))
+
+        if self.cancelled.is_set():
+            results.put(('text', "\nRun cancelled\n"))
+        results.put(('done',))
+
+    def poll_results(self):
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'tokens':
+                self.output_view.set_tokens(message[1])
+                self.progress.config(maximum=max(len(message[1]), 1))
+            elif message[0] == 'progress':
+                self.progress.config(value=message[1])
+            elif message[0] == 'text':
+                self.output_view.add_message(message[1])
+            else:
+                self.finish_run()
+                return
+        self.root.after(POLL_MS, self.poll_results)
+
+    def cancel_run(self):
+        self.cancelled.set()
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def finish_run(self):
+        # Edits made during the run were not lexed yet
+        self.highlighted = None
+        self.worker = None
+        self.sync_input()
+        self.run_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def jump_target(self):
+        try:
+            return int(self.jump_entry.get())
+        except ValueError:
+            return None
+
+    def jump_to_index(self):
+        index = self.jump_target()
+        if index is None or not self.output_view.jump_to_index(index):
+            self.root.bell()
+
+    def jump_to_offset(self):
+        offset = self.jump_target()
+        if offset is None or not self.output_view.jump_to_offset(offset):
+            self.root.bell()
 
     def select_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("SupplyScript files", "*.supp")])
@@ -1,3 +1,6 @@
+from bisect import bisect_right
+
+
 def string_with_arrows(text, pos_start, pos_end):
     result = ''
 
@@ -23,4 +26,41 @@ def string_with_arrows(text, pos_start, pos_end):
         idx_end = text.find('\n', idx_start + 1)
         if idx_end < 0: idx_end = len(text)
 
-    return result.replace('\t', '')
\ No newline at end of file
+    return result.replace('\t', '')
+
+
+def strings_with_arrows(text, spans, starts):
+    # string_with_arrows for many (pos_start, pos_end) pairs over one text.
+    # `starts` is the line start table of a supp.LineIndex over `text`, so the
+    # text is not rescanned for every error, and each result is built as a list
+    # of parts.
+    return [render_arrows(text, starts, pos_start, pos_end) for pos_start, pos_end in spans]
+
+
+def render_arrows(text, starts, pos_start, pos_end):
+    # Same lines and carets as string_with_arrows, line ends found by bisect
+    parts = []
+
+    # Calculate indices: the '\n' before the first line, and the index in
+    # `starts` of the line after the next '\n'
+    line = bisect_right(starts, pos_start.idx) - 1
+    idx_start = starts[line] - 1 if line > 0 else 0
+    after = bisect_right(starts, idx_start + 1)
+
+    # Generate each line
+    line_count = pos_end.ln - pos_start.ln + 1
+    for i in range(line_count):
+        idx_end = starts[after] - 1 if after < len(starts) else len(text)
+        line = text[idx_start:idx_end]
+        if not isinstance(line, str):
+            line = line.decode('ascii')  # a LineIndex over pure-ASCII bytes
+        col_start = pos_start.col if i == 0 else 0
+        col_end = pos_end.col if i == line_count - 1 else len(line) - 1
+
+        parts.append(line)
+        parts.append('\n' + ' ' * col_start + '^' * (col_end - col_start))
+
+        idx_start = idx_end
+        after += 1
+
+    return ''.join(parts).replace('\t', '')
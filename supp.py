@@ -1,6 +1,18 @@
-
-
+import hashlib
+import io
+import mmap
 import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from enum import IntEnum
+from itertools import repeat
+
+from strings_with_arrows import strings_with_arrows
 
 ###############################
 # DIGITS
@@ -45,385 +57,1688 @@ ATTRIBUTES = {'name', 'supplier', 'product', 'quantity', 'location', 'weight', '
 ###############################
 RESERVED_WORDS = {'alert', 'undo', 'exec', 'update', 'optimize', 'show', 'allowArithmetic'}
 
+###############################
+# NOISE WORDS
+###############################
+# Reserved word written with a noise suffix: spelling -> (reserved word, noise)
+NOISE_WORDS = {
+    'execute': ('exec', 'ute'),
+    'updateInventory': ('update', 'Inventory'),
+    'optimizeInventoryLevels': ('optimize', 'InventoryLevels'),
+}
+
 
 ###############################
 # ERRORS
 ###############################
 
 class Error:
-    def __init__(self, error_name, details):
+    def __init__(self, error_name, details, start=None, end=None):
         self.error_name = error_name
         self.details = details
+        self.start = start  # source offsets of the offending text
+        self.end = end
 
     def as_string(self):
         result = f'{self.error_name}{self.details}'
         return result
 
+    def as_string_with_arrows(self, lines):
+        # as_string() plus the source lines of the error with carets under it;
+        # `lines` is the LineIndex of the lexed text
+        return errors_with_arrows([self], lines)[0]
+
+
+def errors_with_arrows(errors, lines):
+    # as_string_with_arrows() for every error, all looked up in one LineIndex
+    spans = [(lines.position(error.start), lines.position(error.end)) for error in errors]
+    arrows = strings_with_arrows(lines.text, spans, lines.starts)
+    return [f'{error.as_string()}\nFile {pos_start.fn}, line {pos_start.ln + 1}\n\n{arrow}'
+            for error, (pos_start, _), arrow in zip(errors, spans, arrows)]
+
 
 class IllegalCharError(Error, Exception):
-    def __init__(self, details):
-        super().__init__('Illegal Character', details)
+    def __init__(self, details, start=None, end=None):
+        super().__init__('Illegal Character', details, start, end)
+        self.args = (details,)  # str() shows the details only
+
+
+class InvalidSyntaxError(Error):
+    def __init__(self, details, start=None, end=None):
+        super().__init__('Invalid Syntax', details, start, end)
+
+
+###############################
+# POSITION
+###############################
+
+class Position:
+    __slots__ = ('idx', 'ln', 'col', 'fn', 'ftxt')
+
+    def __init__(self, idx, ln, col, fn, ftxt):
+        self.idx = idx
+        self.ln = ln
+        self.col = col
+        self.fn = fn
+        self.ftxt = ftxt
+
+    def copy(self):
+        return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+
+
+class LineIndex:
+    # Start offset of every line, found with one str.find pass. Lexers only keep
+    # offsets; (line, column) pairs are looked up here when something asks.
+    def __init__(self, text, fn='<stdin>'):
+        self.text = text
+        self.fn = fn
+        newline = '\n' if isinstance(text, str) else b'\n'
+        self.starts = array('I' if len(text) < 1 << 32 else 'Q', [0])
+        find = text.find
+        pos = find(newline)
+        while pos >= 0:
+            self.starts.append(pos + 1)
+            pos = find(newline, pos + 1)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def line_col(self, offset):
+        # 0-based (line, column) of a source offset
+        line = bisect_right(self.starts, offset) - 1
+        return line, offset - self.starts[line]
+
+    def position(self, offset):
+        line, col = self.line_col(offset)
+        return Position(offset, line, col, self.fn, self.text)
 
 
 ###############################
 # TOKENS
 ###############################
 
-TT_INT                  = 'INT:                           '
-TT_FLOAT                = 'FLOAT:                         '
-TT_LPAREN               = 'LEFTPAREN:                      ' + '('
-TT_RPAREN               = 'RIGHTPAREN:                    ' + ')'
-TT_SCOLON               = 'SEMICOLON:                      ' + ';'
-TT_COLON                = 'COLON:                         ' + ':'
-TT_OCBRACE              = 'OPENCURLBRACE:                 ' + '{'
-TT_CCBRACE              = 'CLOSECURLBRACE:                ' + '}'
-TT_DQUOTATION           = 'DOUBLEQUOTATION:               ' + '"'
-TT_SQUOTATION           = 'SINGLEQUOTATION:               ' + "'"
-TT_ASSIGNMENT_EQUAL     = 'ASSIGNOPRTR_EQUAL:         ' + '='
-TT_ASSIGNMENT_COLON     = 'ASSIGNOPRTR_COLON:          ' + ':'
-TT_STRLITERAL           = 'STRINGLITERAL:                 '
-TT_IDENTIFIER           = 'IDENTIFIER:                    '
-TT_ADD                  = 'ADDSYMBOL:                     ' + '+'
-TT_SUB                  = 'SUBTRACTSYMBOL:                ' + '-'
-TT_MUL                  = 'MULTIPLYSYMBOL:          ' + '*'
-TT_DIV                  = 'DIVISIONSYMBOL:                ' + '/'
-TT_CLASSTYPE            = 'CLASSTYPE:                    '
-TT_ATTRIBUTE            = 'ATTRIBUTE:                     '
-TT_RESERVEDWORD         = 'RESERVEDWORD:                  '
-TT_SPECIALCHAR          = 'SPECIALCHAR:                '
-TT_SINGLECOMMENT        = 'SINGLECOMMENT:                 ' + '//'
-TT_STARTCOMMENT         = 'STARTCOMMENT:                  ' + '/*'
-TT_ENDCOMMENT           = 'ENDCOMMENT:                    ' + '*/'
-TT_COMMENT              = 'COMMENT:                       '
-TT_MOD                  = 'MOD:                                 ' + '%'
-TT_EXP                  = 'EXP:                                   ' + '^'
-TT_FLOOR                = 'FLOOR:                         ' + '/.'
-TT_EQUIVAL              = 'EQUIVAL:                       ' + '=='
-TT_NOTEQUAL             = 'NOTEQUAL:                      ' + '!='
-TT_GREATER              = 'GREATER:                       ' + '>'
-TT_LESS                 = 'LESS:                          ' + '<'
-TT_LEQUAL               = 'LEQUAL:                        ' + '<='
-TT_GEQUAL               = 'GEQUAL:                        ' + '>='
-TT_AND                  = 'AND:                           ' + '&&'
-TT_OR                   = 'OR:                            ' + '||'
-TT_NOT                  = 'NOT:                                   ' + '!'
+class TokenKind(IntEnum):
+    INT                     = 1
+    FLOAT                   = 2
+    LPAREN                  = 3
+    RPAREN                  = 4
+    SCOLON                  = 5
+    COLON                   = 6
+    OCBRACE                 = 7
+    CCBRACE                 = 8
+    DQUOTATION              = 9
+    SQUOTATION              = 10
+    ASSIGNMENT_EQUAL        = 11
+    ASSIGNMENT_COLON        = 12
+    STRLITERAL              = 13
+    IDENTIFIER              = 14
+    ADD                     = 15
+    SUB                     = 16
+    MUL                     = 17
+    DIV                     = 18
+    CLASSTYPE               = 19
+    ATTRIBUTE               = 20
+    RESERVEDWORD            = 21
+    SPECIALCHAR             = 22
+    SINGLECOMMENT           = 23
+    STARTCOMMENT            = 24
+    ENDCOMMENT              = 25
+    COMMENT                 = 26
+    MOD                     = 27
+    EXP                     = 28
+    FLOOR                   = 29
+    EQUIVAL                 = 30
+    NOTEQUAL                = 31
+    GREATER                 = 32
+    LESS                    = 33
+    LEQUAL                  = 34
+    GEQUAL                  = 35
+    AND                     = 36
+    OR                      = 37
+    NOT                     = 38
+
+
+# Kind byte -> TokenKind member, several times cheaper than calling TokenKind()
+KIND_MEMBERS = {kind: kind for kind in TokenKind}
+
+TT_INT                  = TokenKind.INT
+TT_FLOAT                = TokenKind.FLOAT
+TT_LPAREN               = TokenKind.LPAREN
+TT_RPAREN               = TokenKind.RPAREN
+TT_SCOLON               = TokenKind.SCOLON
+TT_COLON                = TokenKind.COLON
+TT_OCBRACE              = TokenKind.OCBRACE
+TT_CCBRACE              = TokenKind.CCBRACE
+TT_DQUOTATION           = TokenKind.DQUOTATION
+TT_SQUOTATION           = TokenKind.SQUOTATION
+TT_ASSIGNMENT_EQUAL     = TokenKind.ASSIGNMENT_EQUAL
+TT_ASSIGNMENT_COLON     = TokenKind.ASSIGNMENT_COLON
+TT_STRLITERAL           = TokenKind.STRLITERAL
+TT_IDENTIFIER           = TokenKind.IDENTIFIER
+TT_ADD                  = TokenKind.ADD
+TT_SUB                  = TokenKind.SUB
+TT_MUL                  = TokenKind.MUL
+TT_DIV                  = TokenKind.DIV
+TT_CLASSTYPE            = TokenKind.CLASSTYPE
+TT_ATTRIBUTE            = TokenKind.ATTRIBUTE
+TT_RESERVEDWORD         = TokenKind.RESERVEDWORD
+TT_SPECIALCHAR          = TokenKind.SPECIALCHAR
+TT_SINGLECOMMENT        = TokenKind.SINGLECOMMENT
+TT_STARTCOMMENT         = TokenKind.STARTCOMMENT
+TT_ENDCOMMENT           = TokenKind.ENDCOMMENT
+TT_COMMENT              = TokenKind.COMMENT
+TT_MOD                  = TokenKind.MOD
+TT_EXP                  = TokenKind.EXP
+TT_FLOOR                = TokenKind.FLOOR
+TT_EQUIVAL              = TokenKind.EQUIVAL
+TT_NOTEQUAL             = TokenKind.NOTEQUAL
+TT_GREATER              = TokenKind.GREATER
+TT_LESS                 = TokenKind.LESS
+TT_LEQUAL               = TokenKind.LEQUAL
+TT_GEQUAL               = TokenKind.GEQUAL
+TT_AND                  = TokenKind.AND
+TT_OR                   = TokenKind.OR
+TT_NOT                  = TokenKind.NOT
+
+# Display labels for each kind. Tokens only carry the integer kind; the padded
+# label is looked up when a token is printed or written to the symbol table.
+TOKEN_LABELS = {
+    TT_INT:                 'INT:                           ',
+    TT_FLOAT:               'FLOAT:                         ',
+    TT_LPAREN:              'LEFTPAREN:                      ' + '(',
+    TT_RPAREN:              'RIGHTPAREN:                    ' + ')',
+    TT_SCOLON:              'SEMICOLON:                      ' + ';',
+    TT_COLON:               'COLON:                         ' + ':',
+    TT_OCBRACE:             'OPENCURLBRACE:                 ' + '{',
+    TT_CCBRACE:             'CLOSECURLBRACE:                ' + '}',
+    TT_DQUOTATION:          'DOUBLEQUOTATION:               ' + '"',
+    TT_SQUOTATION:          'SINGLEQUOTATION:               ' + "'",
+    TT_ASSIGNMENT_EQUAL:    'ASSIGNOPRTR_EQUAL:         ' + '=',
+    TT_ASSIGNMENT_COLON:    'ASSIGNOPRTR_COLON:          ' + ':',
+    TT_STRLITERAL:          'STRINGLITERAL:                 ',
+    TT_IDENTIFIER:          'IDENTIFIER:                    ',
+    TT_ADD:                 'ADDSYMBOL:                     ' + '+',
+    TT_SUB:                 'SUBTRACTSYMBOL:                ' + '-',
+    TT_MUL:                 'MULTIPLYSYMBOL:          ' + '*',
+    TT_DIV:                 'DIVISIONSYMBOL:                ' + '/',
+    TT_CLASSTYPE:           'CLASSTYPE:                    ',
+    TT_ATTRIBUTE:           'ATTRIBUTE:                     ',
+    TT_RESERVEDWORD:        'RESERVEDWORD:                  ',
+    TT_SPECIALCHAR:         'SPECIALCHAR:                ',
+    TT_SINGLECOMMENT:       'SINGLECOMMENT:                 ' + '//',
+    TT_STARTCOMMENT:        'STARTCOMMENT:                  ' + '/*',
+    TT_ENDCOMMENT:          'ENDCOMMENT:                    ' + '*/',
+    TT_COMMENT:             'COMMENT:                       ',
+    TT_MOD:                 'MOD:                                 ' + '%',
+    TT_EXP:                 'EXP:                                   ' + '^',
+    TT_FLOOR:               'FLOOR:                         ' + '/.',
+    TT_EQUIVAL:             'EQUIVAL:                       ' + '==',
+    TT_NOTEQUAL:            'NOTEQUAL:                      ' + '!=',
+    TT_GREATER:             'GREATER:                       ' + '>',
+    TT_LESS:                'LESS:                          ' + '<',
+    TT_LEQUAL:              'LEQUAL:                        ' + '<=',
+    TT_GEQUAL:              'GEQUAL:                        ' + '>=',
+    TT_AND:                 'AND:                           ' + '&&',
+    TT_OR:                  'OR:                            ' + '||',
+    TT_NOT:                 'NOT:                                   ' + '!',
+}
 
 
 class Token:
-    def __init__(self, type, value=None):
-        self.type = type
+    __slots__ = ('kind', 'value', 'start', 'end')
+
+    def __init__(self, kind, value=None, start=None, end=None):
+        self.kind = kind
         self.value = value
+        self.start = start
+        self.end = end
+
+    @property
+    def type(self):
+        return self.kind
 
     def __repr__(self):
+        label = TOKEN_LABELS[self.kind]
         if self.value is not None:
             if '\n' in self.value:
                 lines=self.value.split('\n')
-                formatted_value='\n'.join([f"{self.type}{repr(line)}" for line in lines])
+                formatted_value='\n'.join([f"{label}{repr(line)}" for line in lines])
                 return formatted_value
-            return f'{self.type}{repr(self.value)}'
-        return f'{self.type}'
+            return f'{label}{repr(self.value)}'
+        return f'{label}'
+
+
+###############################
+# IDENTIFIERS
+###############################
+
+def build_keywords():
+    # Every keyword spelling -> one shared (kind, value) result. Each spelling is
+    # also keyed by its ASCII bytes, so byte-level lexers look up a match as is.
+    # Later groups win, matching the old check order: class types, then
+    # attributes, then reserved words, then noise words.
+    keywords = {}
+    for spelling, (word, noise) in NOISE_WORDS.items():
+        keywords[spelling] = (TT_RESERVEDWORD, f' {word} | NOISEWORD: {noise}')
+    for kind, words in ((TT_RESERVEDWORD, RESERVED_WORDS), (TT_ATTRIBUTE, ATTRIBUTES), (TT_CLASSTYPE, CLASS_TYPES)):
+        for word in words:
+            keywords[word] = (kind, f' {word}')
+    for spelling, result in list(keywords.items()):
+        keywords[spelling.encode('ascii')] = result
+    return keywords
+
+
+KEYWORDS = build_keywords()
+NOT_KEYWORD = (TT_IDENTIFIER, None)
+
+
+###############################
+# TOKEN BUFFER
+###############################
+
+# Kinds whose value is the token's source text, minus a number of delimiter
+# characters at each end. Keyword kinds map their spelling through KEYWORDS;
+# every other kind has no value.
+VALUE_SLICES = {
+    TT_INT: 0,
+    TT_FLOAT: 0,
+    TT_IDENTIFIER: 0,
+    TT_SPECIALCHAR: 0,
+    TT_COMMENT: 0,
+    TT_STRLITERAL: 1,
+    TT_CLASSTYPE: 0,
+    TT_ATTRIBUTE: 0,
+    TT_RESERVEDWORD: 0,
+}
+
+KEYWORD_KINDS = {TT_CLASSTYPE, TT_ATTRIBUTE, TT_RESERVEDWORD}
+
+
+def token_value(text, kind, start, end):
+    strip = VALUE_SLICES.get(kind)
+    if strip is None:
+        return None
+    value = text[start + strip:end - strip]
+    if kind in KEYWORD_KINDS:
+        return KEYWORDS[value][1]
+    if not isinstance(value, str):
+        value = value.decode('ascii')  # only materialized values are decoded
+    return value
+
+
+class TokenBuffer:
+    # Struct-of-arrays token storage: a kind byte and start/end source offsets per
+    # token. Values are only sliced out of the source when a token is indexed.
+    def __init__(self, text):
+        self.text = text
+        offset_type = 'I' if len(text) < 1 << 32 else 'Q'
+        self.kinds = array('B')
+        self.starts = array(offset_type)
+        self.ends = array(offset_type)
+        self.line_index = None
+
+    @property
+    def lines(self):
+        # Built the first time a line/column position is asked for
+        if self.line_index is None:
+            self.line_index = LineIndex(self.text)
+        return self.line_index
+
+    def positions(self, index):
+        # (start, end) Position objects of token `index`
+        return self.lines.position(self.starts[index]), self.lines.position(self.ends[index])
+
+    def append(self, kind, start, end):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def value(self, index):
+        return token_value(self.text, self.kinds[index], self.starts[index], self.ends[index])
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        kind = KIND_MEMBERS[self.kinds[index]]
+        start = self.starts[index]
+        end = self.ends[index]
+        return Token(kind, token_value(self.text, kind, start, end), start, end)
+
+    def __getstate__(self):
+        # An mmap source cannot be pickled; send the bytes it maps instead
+        state = self.__dict__.copy()
+        if not isinstance(self.text, (str, bytes)):
+            state['text'] = self.text[:]
+        return state
+
+    def __iter__(self):
+        text = self.text
+        for kind, start, end in zip(self.kinds, self.starts, self.ends):
+            kind = KIND_MEMBERS[kind]
+            yield Token(kind, token_value(text, kind, start, end), start, end)
+
+
+###############################
+# SYMBOL TABLE
+###############################
+
+class SymbolTable:
+    # Interns identifier and string-literal spellings to integer ids, and keeps
+    # the start offset of every occurrence of each. Identifiers and string
+    # literals are separate namespaces sharing one id sequence.
+    def __init__(self):
+        self.ids = {TT_IDENTIFIER: {}, TT_STRLITERAL: {}}  # kind -> spelling -> id
+        self.names = []
+        self.kinds = array('B')
+        self.offsets = []  # id -> array of occurrence offsets
+
+    def add(self, kind, spelling, offset):
+        if not isinstance(spelling, str):
+            spelling = spelling.decode('ascii')
+        ids = self.ids[kind]
+        symbol_id = ids.get(spelling)
+        if symbol_id is None:
+            symbol_id = ids[spelling] = len(self.names)
+            self.names.append(spelling)
+            self.kinds.append(kind)
+            self.offsets.append(array('Q'))
+        self.offsets[symbol_id].append(offset)
+        return symbol_id
+
+    def add_tokens(self, tokens):
+        # Fill the table from already lexed tokens, e.g. a cached TokenBuffer
+        if hasattr(tokens, 'kinds'):
+            text = tokens.text
+            for kind, start, end in zip(tokens.kinds, tokens.starts, tokens.ends):
+                if kind == TT_IDENTIFIER:
+                    self.add(TT_IDENTIFIER, text[start:end], start)
+                elif kind == TT_STRLITERAL:
+                    self.add(TT_STRLITERAL, text[start + 1:end - 1], start)
+        else:
+            for token in tokens:
+                if token.kind in self.ids:
+                    self.add(token.kind, token.value, token.start)
+        return self
+
+    def lookup(self, name, kind=TT_IDENTIFIER):
+        # Id of a spelling, or None
+        return self.ids[kind].get(name)
+
+    def uses(self, name, kind=TT_IDENTIFIER):
+        # Start offsets of every occurrence of a spelling
+        symbol_id = self.ids[kind].get(name)
+        return self.offsets[symbol_id] if symbol_id is not None else array('Q')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids[TT_IDENTIFIER]
+
+    def __iter__(self):
+        # (id, kind, name, offsets) per symbol, in order of first appearance
+        for symbol_id, name in enumerate(self.names):
+            yield symbol_id, TokenKind(self.kinds[symbol_id]), name, self.offsets[symbol_id]
 
 
 ###############################
 # LEXER
 ###############################
 
+# Each scanner finds the end of its token in one C-level match or str.find and
+# takes a single slice, instead of growing the value one character at a time.
+IDENTIFIER_PATTERN = re.compile(f'[{re.escape(LETTERS + "$_")}][{re.escape(LETTERS + DIGITS + "_$")}]*')
+NUMBER_PATTERN = re.compile(f'[{DIGITS}]*(?:\\.[{DIGITS}]*)?')
+SPECIALCHAR_PATTERN = re.compile(f'[{re.escape(SPECIALCHAR)}]+')
+WHITESPACE_PATTERN = re.compile('[ \t\n]+')
+
+# What the lexers keep of each comment: all of its tokens ('all'), nothing at
+# all ('code'), or one COMMENT token spanning the whole comment, delimiters
+# included ('spans'). Token values are sliced from the source only when read,
+# so a kept span costs no comment text until someone asks for it.
+KEEP_MODES = ('all', 'code', 'spans')
+
+
+def check_keep(keep):
+    if keep not in KEEP_MODES:
+        raise ValueError(f"Unknown keep mode '{keep}', expected one of {', '.join(KEEP_MODES)}")
+    return keep
+
+OPERATOR_TOKENS = {
+    '/.': TT_FLOOR,
+    '==': TT_EQUIVAL,
+    '!=': TT_NOTEQUAL,
+    '<=': TT_LEQUAL,
+    '>=': TT_GEQUAL,
+    '&&': TT_AND,
+    '||': TT_OR,
+    '(': TT_LPAREN,
+    ')': TT_RPAREN,
+    '{': TT_OCBRACE,
+    '}': TT_CCBRACE,
+    ';': TT_SCOLON,
+    '=': TT_ASSIGNMENT_EQUAL,
+    ':': TT_ASSIGNMENT_COLON,
+    '+': TT_ADD,
+    '-': TT_SUB,
+    '*': TT_MUL,
+    '/': TT_DIV,
+    '%': TT_MOD,
+    '^': TT_EXP,
+    '!': TT_NOT,
+    '<': TT_LESS,
+    '>': TT_GREATER,
+}
+
+BYTES_OPERATOR_TOKENS = {oprtr.encode('ascii'): kind for oprtr, kind in OPERATOR_TOKENS.items()}
+
+
 class Lexer:
-    def __init__(self, text):
+    byte_level = False  # needs str input
+
+    def __init__(self, text, keep='all', symbols=None):
         self.text = text
         self.pos = -1
         self.current_char = None
+        self.keep = check_keep(keep)
+        self.symbols = symbols  # a SymbolTable to fill while lexing
+        self.errors = None  # a list while recovering from errors instead of stopping
+        self.unclosed = {}  # delimiter -> offset after which it has no closing match
         self.advance()
 
     def advance(self):
         self.pos += 1
         self.current_char = self.text[self.pos] if self.pos < len(self.text) else None
 
+    def jump(self, pos):
+        self.pos = pos
+        self.current_char = self.text[pos] if pos < len(self.text) else None
+
     def make_tokens(self):
-        tokens = []
+        # Each character is sent straight to its handler through LEXER_DISPATCH;
+        # a handler returns an Error to stop lexing
+        tokens = TokenBuffer(self.text)
+        dispatch = LEXER_DISPATCH
         while self.current_char is not None:
-            if self.current_char in '\t':
-                self.advance()
-            elif self.current_char in '\n':
-                self.advance()
-            elif self.current_char in " ":
-                self.advance()
-
-            # Check for single-line comment
-            elif self.current_char == '/' and self.peek() == '/':
-                comment_text = self.make_single_line_comment()
-                tokens.append(Token(TT_SINGLECOMMENT))
-                tokens.append(Token(TT_COMMENT, comment_text))
-
-            # Check for multi-line comment
-            elif self.current_char == '/' and self.peek() == '*':
-                comment_text = self.make_multi_line_comment()
-                tokens.append(Token(TT_STARTCOMMENT))
-                tokens.append(Token(TT_COMMENT, comment_text))
-                tokens.append(Token(TT_ENDCOMMENT))
-
-            elif self.current_char in DIGITS:
-                tokens.append(self.make_number())
-            elif self.current_char in LETTERS:
-                tokens.append(self.make_identifier())
-
-            elif self.current_char in QUOTATIONS:
-                result = self.make_string_literal()
-                if isinstance(result, Token):
-                    tokens.append(result)
-                else:
-                    return tokens, result  # Return the error along with tokens
-
-            elif self.current_char in PARENTHESES:
-                if self.current_char == '(':
-                    tokens.append(Token(TT_LPAREN))
-                    self.advance()
-                elif self.current_char == ')':
-                    tokens.append(Token(TT_RPAREN))
-                    self.advance()
-            elif self.current_char in CURLYBRACE:
-                if self.current_char == '{':
-                    tokens.append(Token(TT_OCBRACE))
-                    self.advance()
-                elif self.current_char == '}':
-                    tokens.append(Token(TT_CCBRACE))
-                    self.advance()
-
-            elif self.current_char in (ASSIGNOPRTR or BOOLOPRTR or SPECIALCHAR):
-                if self.current_char == '=':
-                    if self.peek() == '=':
-                        tokens.append(Token(TT_EQUIVAL))
-                        self.advance()
-                        self.advance()
-                    else:
-                        tokens.append(Token(TT_ASSIGNMENT_EQUAL))
-                        self.advance()
-                elif self.current_char == ':':
-                    tokens.append(Token(TT_ASSIGNMENT_COLON))
-                    self.advance()
-
-            elif self.current_char == ';':
-                tokens.append(Token(TT_SCOLON))
-                self.advance()
-
-
-            elif self.current_char == '&':
-                if self.peek() == '&':
-                    tokens.append(Token(TT_AND))
-                    self.advance()
-                    self.advance()
-                else:
-                    tokens.append(Token(TT_SPECIALCHAR, '&'))
-                    self.advance()
-
-
-            elif self.current_char == '|':
-                if self.peek() == '|':
-                    tokens.append(Token(TT_OR))
-                    self.advance()
-                    self.advance()
-                else:
-                    tokens.append(Token(TT_SPECIALCHAR, '|'))
-                    self.advance()
-
-            elif self.current_char in SPECIALCHAR:
-                tokens.append(self.make_specialchar())
-
-            elif self.current_char in ARITHMETICOPRTR:
-                tokens.append(self.make_arithmetic_operator())
-
-            elif self.current_char in BOOLOPRTR:
-                if self.current_char == '!':
-                    if self.peek() == '=':
-                        tokens.append(Token(TT_NOTEQUAL))
-                        self.advance()
-                        self.advance()
-                    else:
-                        tokens.append(Token(TT_NOT))
-                        self.advance()
-                elif self.current_char == '<':
-                    if self.peek() == '=':
-                        tokens.append(Token(TT_LEQUAL))
-                        self.advance()
-                        self.advance()
-                    else:
-                        tokens.append(Token(TT_LESS))
-                        self.advance()
-                elif self.current_char == '>':
-                    if self.peek() == '=':
-                        tokens.append(Token(TT_GEQUAL))
-                        self.advance()
-                        self.advance()
-                    else:
-                        tokens.append(Token(TT_GREATER))
-                        self.advance()
-
-            else:  # return an error message
-                char = self.current_char
-                self.advance()
-                return tokens, IllegalCharError("'" + char + "'")
-
+            error = dispatch.get(self.current_char, Lexer.lex_illegal)(self, tokens)
+            if error is not None:
+                return tokens, error  # Return the error along with tokens
         return tokens, None
 
-    def make_arithmetic_operator(self):
-        oprtr_str = self.current_char
+    def make_tokens_recovering(self):
+        # One pass over the whole text that records every error and carries on
+        # after it, instead of stopping at the first. Returns (tokens, errors).
+        self.errors = []
+        tokens, _ = self.make_tokens()
+        return tokens, self.errors
+
+    def recover(self, error):
+        # An unterminated string or comment ends at the end of its line, and
+        # lexing resumes from there
+        self.errors.append(error.with_traceback(None))  # a kept traceback pins its frames
+        end = self.text.find('\n', error.start)
+        error.end = end if end >= 0 else len(self.text)
+        self.jump(error.end)
+
+    ###############################
+    # HANDLERS
+    ###############################
+
+    def lex_whitespace(self, tokens):
+        self.jump(WHITESPACE_PATTERN.match(self.text, self.pos).end())
+
+    def lex_slash(self, tokens):
+        start = self.pos
+        next_char = self.peek()
+        if next_char == '/':
+            self.make_single_line_comment()
+            if self.keep == 'all':
+                tokens.append(TT_SINGLECOMMENT, start, start + 2)
+                tokens.append(TT_COMMENT, start + 2, self.pos)
+            elif self.keep == 'spans':
+                tokens.append(TT_COMMENT, start, self.pos)
+        elif next_char == '*':
+            try:
+                self.make_multi_line_comment()
+            except IllegalCharError as e:
+                if self.errors is None:
+                    raise
+                self.recover(e)
+                return None
+            if self.keep == 'all':
+                tokens.append(TT_STARTCOMMENT, start, start + 2)
+                tokens.append(TT_COMMENT, start + 2, self.pos - 2)
+                tokens.append(TT_ENDCOMMENT, self.pos - 2, self.pos)
+            elif self.keep == 'spans':
+                tokens.append(TT_COMMENT, start, self.pos)
+        else:
+            self.lex_operator(tokens)
+
+    def lex_operator(self, tokens):
+        # Two-character operators first ('==', '<=', '&&', '/.', ...), then one
+        start = self.pos
+        pair = self.text[start:start + 2]
+        kind = OPERATOR_TOKENS.get(pair) if len(pair) == 2 else None
+        if kind is not None:
+            self.jump(start + 2)
+        else:
+            kind = OPERATOR_TOKENS.get(self.current_char, TT_SPECIALCHAR)  # a lone '&' or '|'
+            self.jump(start + 1)
+        tokens.append(kind, start, self.pos)
+
+    def lex_number(self, tokens):
+        start = self.pos
+        tokens.append(self.make_number(), start, self.pos)
+
+    def lex_identifier(self, tokens):
+        start = self.pos
+        kind = self.make_identifier()
+        tokens.append(kind, start, self.pos)
+        if kind == TT_IDENTIFIER and self.symbols is not None:
+            self.symbols.add(TT_IDENTIFIER, self.text[start:self.pos], start)
+
+    def lex_string(self, tokens):
+        start = self.pos
+        result = self.make_string_literal()
+        if not isinstance(result, Error):
+            tokens.append(result, start, self.pos)
+            if self.symbols is not None:
+                self.symbols.add(TT_STRLITERAL, self.text[start + 1:self.pos - 1], start)
+        elif self.errors is None:
+            return result
+        else:
+            self.recover(result)
 
-        if oprtr_str =='/':
-            if self.peek()=='.':
-                oprtr_str +=self.peek()
-                self.advance()
-                self.advance()
-                return Token(TT_FLOOR)
-        self.advance()
+    def lex_specialchar(self, tokens):
+        start = self.pos
+        tokens.append(self.make_specialchar(), start, self.pos)
 
-        if oprtr_str == '+':
-            return Token(TT_ADD)
-        elif oprtr_str == '-':
-            return Token(TT_SUB)
-        elif oprtr_str == '*':
-            return Token(TT_MUL)
-        elif oprtr_str == '/':
-            return Token(TT_DIV)
-        elif oprtr_str == '%':
-            return Token(TT_MOD)
-        elif oprtr_str == '^':
-            return Token(TT_EXP)
-        elif oprtr_str == '/.':
-            return Token(TT_FLOOR)
+    def lex_illegal(self, tokens):
+        char = self.current_char
+        self.advance()
+        error = IllegalCharError("'" + char + "'", self.pos - 1, self.pos)
+        if self.errors is None:
+            return error
+        self.errors.append(error)
 
     def peek(self):
         peek_pos = self.pos + 1
         return self.text[peek_pos] if peek_pos < len(self.text) else None
 
     def make_single_line_comment(self):
-        self.advance()  # Move past the '/'
-        self.advance()  # Move past the '/'
-        comment_text = ''
-        while self.current_char is not None and self.current_char != '\n':
-            comment_text += self.current_char
-            self.advance()
-        return comment_text
+        end = self.text.find('\n', self.pos + 2)  # Skip the '//'
+        if end < 0:
+            end = len(self.text)
+        self.jump(end)
 
     def make_multi_line_comment(self):
-        self.advance()  # Move past the '/'
-        self.advance()  # Move past the '*'
-        comment_text = ''
-        while self.current_char is not None and not (self.current_char == '*' and self.peek() == '/'):
-            if self.current_char=='\n':
-                comment_text += self.current_char
-            else:
-                comment_text += self.current_char
-            self.advance()
-
-        if self.current_char is None:
+        start = self.pos + 2  # Skip the '/*'
+        end = self.close_of('*/', start)
+        if end < 0:
+            self.jump(len(self.text))
             raise IllegalCharError(
-                f"Unterminated multi-line comment starting at position {self.pos - len(comment_text)}")
-        self.advance()  # Move past the '*'
-        self.advance()  # Move past the '/'
-        return comment_text
+                f"Unterminated multi-line comment starting at position {start}", start - 2, self.pos)
+        self.jump(end + 2)  # Move past the '*/'
 
     def make_identifier(self):
-        id_str = ''
         # A name must begin with a letter (A-Z or a-z), dollar sign ($), or an underscore (_)
-        if self.current_char is not None and self.current_char in LETTERS + '$_':
-            id_str += self.current_char
-            self.advance()
-        else:
-            return Token(TT_IDENTIFIER, None)  # Invalid identifier
-
         # Subsequent characters may be letters, digits, underscores, or dollar signs
-        while self.current_char is not None and self.current_char in LETTERS + DIGITS + '_$':
-            id_str += self.current_char
-            self.advance()
-
-        # Identify class type, attribute, or reserved word
-        if id_str in CLASS_TYPES:
-            return Token(TT_CLASSTYPE, f' {id_str}')
-        elif id_str in ATTRIBUTES:
-            return Token(TT_ATTRIBUTE, f' {id_str}')
-        elif id_str in RESERVED_WORDS:
-            return Token(TT_RESERVEDWORD, f' {id_str}')
-        elif id_str == 'execute':
-            r_word = id_str[:4]
-            return Token(TT_RESERVEDWORD, f' {r_word} | NOISEWORD: ute')
-        elif id_str == 'updateInventory':
-            r_word = id_str[:6]
-            return Token(TT_RESERVEDWORD, f' {r_word} | NOISEWORD: Inventory')
-        elif id_str == 'optimizeInventoryLevels':
-            r_word = id_str[:8]
-            return Token(TT_RESERVEDWORD, f' {r_word} | NOISEWORD: InventoryLevels')
-        else:
-            return Token(TT_IDENTIFIER, id_str)
+        m = IDENTIFIER_PATTERN.match(self.text, self.pos)
+        if m is None:
+            return TT_IDENTIFIER  # Invalid identifier
+        self.jump(m.end())
+        return KEYWORDS.get(m.group(), NOT_KEYWORD)[0]
 
     def make_number(self):
-        num_str = ''
-        dot_count = 0
-
-        while self.current_char is not None and self.current_char in DIGITS + '.':
-            if self.current_char == '.':
-                if dot_count:
-                    break
-                dot_count = 1
-                num_str += '.'
-            else:
-                num_str += self.current_char
-            self.advance()
+        # Digits with at most one '.'; a second '.' ends the number
+        m = NUMBER_PATTERN.match(self.text, self.pos)
+        self.jump(m.end())
 
-        if dot_count == 0:
-            return Token(TT_INT, str(num_str))
+        if '.' not in m.group():
+            return TT_INT
         else:
-            return Token(TT_FLOAT, str(num_str))
+            return TT_FLOAT
 
     def make_string_literal(self):
         quote_type = self.current_char
-        self.advance()
-        str_literal = ""
-        while self.current_char is not None and self.current_char != quote_type:
-            str_literal += self.current_char
-            self.advance()
-        if self.current_char == quote_type:
-            self.advance()
-            return Token(TT_STRLITERAL, str_literal)
+        start = self.pos + 1
+        end = self.close_of(quote_type, start)
+        if end >= 0:
+            self.jump(end + 1)  # Move past the closing quote
+            return TT_STRLITERAL
         else:
-            return IllegalCharError(f"Unterminated string literal starting at position {self.pos - len(str_literal)}")
+            self.jump(len(self.text))
+            return IllegalCharError(f"Unterminated string literal starting at position {start}", start - 1, self.pos)
+
+    def close_of(self, delimiter, start):
+        # text.find(delimiter, start), remembering a failed search: when nothing
+        # closes after `start`, nothing closes after any later offset either,
+        # so recovering from many unterminated openers stays linear
+        if start >= self.unclosed.get(delimiter, len(self.text) + 1):
+            return -1
+        end = self.text.find(delimiter, start)
+        if end < 0:
+            self.unclosed[delimiter] = start
+        return end
 
     def make_specialchar(self):
-        id_str = self.current_char
-        self.advance()
+        m = SPECIALCHAR_PATTERN.match(self.text, self.pos)
+        self.jump(m.end())
+        return TT_SPECIALCHAR
+
+
+def build_dispatch():
+    # First character -> Lexer handler, in increasing priority: ';', '&' and
+    # '|' are special characters but get their own tokens, and '/' may also
+    # start a comment. Anything missing is an illegal character.
+    dispatch = {}
+    for char in SPECIALCHAR:
+        dispatch[char] = Lexer.lex_specialchar
+    for oprtr in ASSIGNOPRTR | BOOLOPRTR | ARITHMETICOPRTR | set(PARENTHESES + CURLYBRACE + ';'):
+        dispatch[oprtr[0]] = Lexer.lex_operator
+    dispatch['/'] = Lexer.lex_slash
+    for char in ' \t\n':
+        dispatch[char] = Lexer.lex_whitespace
+    for char in DIGITS:
+        dispatch[char] = Lexer.lex_number
+    for char in LETTERS:
+        dispatch[char] = Lexer.lex_identifier
+    for char in QUOTATIONS:
+        dispatch[char] = Lexer.lex_string
+    return dispatch
+
+
+LEXER_DISPATCH = build_dispatch()
 
-        while self.current_char is not None and self.current_char in SPECIALCHAR:
-            id_str += self.current_char
-            self.advance()
 
-        return Token(TT_SPECIALCHAR, id_str)
+###############################
+# REGEX LEXER
+###############################
+
+# One alternation covering every token the Lexer emits. Leading whitespace is
+# folded into each match so blanks never cost a loop iteration of their own.
+# Order matters: FLOAT before INT, terminated comments and string literals
+# before their bare opening delimiters, and '=', '<', '>', '!', '/' only match
+# as single-char operators when they do not start a longer one.
+MASTER_PATTERN = re.compile(r"""
+    [ \t\n]*
+    (?:
+        (?P<IDENTIFIER>[A-Za-z][A-Za-z0-9_$]*)
+      | (?P<SIMPLE>[(){};:+\-*%^]|[=!<>](?!=)|/(?![/*.]))
+      | (?P<FLOAT>[0-9]+\.[0-9]*)
+      | (?P<INT>[0-9]+)
+      | (?P<STRLITERAL>"[^"]*"|'[^']*')
+      | (?P<SINGLECOMMENT>//[^\n]*)
+      | (?P<MULTICOMMENT>/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)
+      | (?P<UNTERMINATED>["']|/\*)
+      | (?P<FIXED>/\.|==|!=|<=|>=|&&|\|\|)
+      | (?P<SPECIALCHAR>[.@\#$₱`_][.;@\#$₱&`_|]*|[&|])
+      | (?P<ILLEGAL>.)
+      | (?P<END>\Z)
+    )
+""", re.VERBOSE | re.DOTALL)
+
+# The same pattern over bytes, for lexing pure-ASCII files straight from an
+# mmap. '₱' can never occur in such a file.
+BYTES_MASTER_PATTERN = re.compile(MASTER_PATTERN.pattern.replace('₱', '').encode('ascii'), re.VERBOSE | re.DOTALL)
+
+# Once a '/*' is known to have no '*/' after it, no later '/*' can close either:
+# these variants send every '/*' straight to UNTERMINATED instead of scanning
+# to the end of the text for each one.
+UNCLOSED_COMMENT_PATTERN = re.compile(
+    MASTER_PATTERN.pattern.replace(r"      | (?P<MULTICOMMENT>/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)" + "\n", ''),
+    re.VERBOSE | re.DOTALL)
+BYTES_UNCLOSED_COMMENT_PATTERN = re.compile(
+    UNCLOSED_COMMENT_PATTERN.pattern.replace('₱', '').encode('ascii'), re.VERBOSE | re.DOTALL)
+
+class RegexLexer:
+    byte_level = True  # accepts ASCII bytes/mmap input as well as str
+
+    def __init__(self, text, offset=0, keep='all', symbols=None):
+        self.text = text
+        self.pos = 0
+        self.end = len(text)
+        self.offset = offset  # position of text[0] in the whole input, for error messages
+        self.keep = check_keep(keep)
+        self.symbols = symbols  # a SymbolTable to fill while lexing
+        self.unterminated = None  # kind of a string literal or comment left open at the end
+        self.comments_close = True  # False once a '/*' was found with no '*/' after it
+
+    def make_tokens(self):
+        tokens = TokenBuffer(self.text)
+        error = self.scan(tokens)
+        return tokens, error
+
+    def scan(self, tokens, final=True):
+        # With final=False the text is only a prefix of the input: stop before
+        # any token that touches its end, since more text could extend it.
+        text = self.text
+        end = self.end
+        add_kind = tokens.kinds.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        binary = not isinstance(text, str)
+        if self.comments_close:
+            pattern = BYTES_MASTER_PATTERN if binary else MASTER_PATTERN
+        else:
+            pattern = BYTES_UNCLOSED_COMMENT_PATTERN if binary else UNCLOSED_COMMENT_PATTERN
+        operators = BYTES_OPERATOR_TOKENS if binary else OPERATOR_TOKENS
+        keep_all = self.keep == 'all'
+        keep_spans = self.keep == 'spans'
+        add_symbol = self.symbols.add if self.symbols is not None else None
+        offset = self.offset
+
+        for m in pattern.finditer(text, self.pos, end):
+            kind = m.lastgroup
+            if not final and (m.end() == end or kind == 'UNTERMINATED'):
+                return None
+            start, self.pos = m.span(kind)
+
+            if kind == 'IDENTIFIER':
+                id_kind = KEYWORDS.get(m.group(kind), NOT_KEYWORD)[0]
+                add_kind(id_kind)
+                if add_symbol and id_kind == TT_IDENTIFIER:
+                    add_symbol(TT_IDENTIFIER, m.group(kind), start + offset)
+            elif kind == 'SIMPLE' or kind == 'FIXED':
+                add_kind(operators[m.group(kind)])
+            elif kind == 'INT':
+                add_kind(TT_INT)
+            elif kind == 'FLOAT':
+                add_kind(TT_FLOAT)
+            elif kind == 'STRLITERAL':
+                add_kind(TT_STRLITERAL)
+                if add_symbol:
+                    add_symbol(TT_STRLITERAL, text[start + 1:self.pos - 1], start + offset)
+            elif kind == 'SPECIALCHAR':
+                add_kind(TT_SPECIALCHAR)
+            elif kind == 'SINGLECOMMENT':
+                if keep_all:
+                    tokens.append(TT_SINGLECOMMENT, start, start + 2)
+                    start += 2
+                elif not keep_spans:
+                    continue
+                add_kind(TT_COMMENT)
+            elif kind == 'MULTICOMMENT':
+                if keep_all:
+                    tokens.append(TT_STARTCOMMENT, start, start + 2)
+                    tokens.append(TT_COMMENT, start + 2, self.pos - 2)
+                    add_kind(TT_ENDCOMMENT)
+                    start = self.pos - 2
+                elif keep_spans:
+                    add_kind(TT_COMMENT)
+                else:
+                    continue
+            elif kind == 'UNTERMINATED':
+                self.unterminated = TT_STARTCOMMENT if self.pos - start == 2 else TT_STRLITERAL
+                self.pos = end
+                start += self.offset
+                if self.unterminated == TT_STARTCOMMENT:
+                    raise IllegalCharError(
+                        f"Unterminated multi-line comment starting at position {start + 2}", start, end + self.offset)
+                return IllegalCharError(f"Unterminated string literal starting at position {start + 1}",
+                                        start, end + self.offset)
+            elif kind == 'ILLEGAL':
+                char = m.group(kind)
+                return IllegalCharError("'" + (char.decode('ascii') if binary else char) + "'",
+                                        start + self.offset, self.pos + self.offset)
+            else:
+                continue
+
+            add_start(start)
+            add_end(self.pos)
+
+        return None
+
+    def make_tokens_recovering(self):
+        # One pass over the whole text that records every error and carries on
+        # after it, instead of stopping at the first. Returns (tokens, errors).
+        tokens = TokenBuffer(self.text)
+        errors = []
+        newline = '\n' if isinstance(self.text, str) else b'\n'
+        while True:
+            try:
+                error = self.scan(tokens)
+            except IllegalCharError as e:
+                error = e.with_traceback(None)  # a kept traceback pins its frames
+                self.comments_close = False
+            if error is None:
+                return tokens, errors
+            errors.append(error)
+            if self.unterminated is not None:
+                # An unterminated string or comment ends at the end of its line
+                end = self.text.find(newline, error.start - self.offset)
+                self.pos = end if end >= 0 else len(self.text)
+                error.end = self.pos + self.offset
+                self.unterminated = None
+
+
+###############################
+# INCREMENTAL LEXER
+###############################
+
+# Characters past an edit re-lexed before looking for the old tokens again; the
+# window doubles until the streams line up or the text ends.
+RESYNC_WINDOW = 256
+DIFF_BLOCK = 4096
+
+
+class IncrementalLexer:
+    # Keeps the token spans of a text and, after an edit, re-lexes only from the
+    # last token boundary before it until the new tokens line up with the old
+    # ones again. Offsets of the tokens behind the last edit are not rewritten on
+    # every keystroke: start(i) and end(i) add `shift` for i >= shift_from.
+    def __init__(self, text=''):
+        self.text = ''
+        self.kinds = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.shift_from = 0
+        self.shift = 0
+        self.error = None
+        self.unterminated = None
+        self.apply_edit(0, 0, text)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def start(self, index):
+        return self.starts[index] + (self.shift if index >= self.shift_from else 0)
+
+    def end(self, index):
+        return self.ends[index] + (self.shift if index >= self.shift_from else 0)
+
+    def token(self, index):
+        kind = TokenKind(self.kinds[index])
+        start, end = self.start(index), self.end(index)
+        return Token(kind, token_value(self.text, kind, start, end), start, end)
+
+    def index_at(self, offset):
+        # Index of the first token ending at or after `offset`
+        return bisect_left(range(len(self.kinds)), offset, key=self.end)
+
+    def settle(self, index):
+        # Make the pending shift start at `index`, rewriting only the offsets in between
+        lo, hi = sorted((index, self.shift_from))
+        if self.shift and lo < hi:
+            delta = self.shift if index > self.shift_from else -self.shift
+            self.starts[lo:hi] = array('q', [pos + delta for pos in self.starts[lo:hi]])
+            self.ends[lo:hi] = array('q', [pos + delta for pos in self.ends[lo:hi]])
+        self.shift_from = index
+
+    def apply_edit(self, start, end, new_text):
+        # Replace text[start:end] with new_text. Returns (first, removed, inserted):
+        # the old tokens first..first+removed were replaced by `inserted` new ones.
+        text = self.text[:start] + new_text + self.text[end:]
+        delta = len(new_text) - (end - start)
+        edit_end = start + len(new_text)
+        self.text = text
+
+        # Tokens ending before the edit cannot change; the one touching it might
+        # grow, and a comment is always re-lexed from its opening delimiter.
+        first = self.index_at(start)
+        while first > 0 and first < len(self.kinds) and self.kinds[first] in (TT_COMMENT, TT_ENDCOMMENT):
+            first -= 1
+        self.settle(first)
+        if first < len(self.kinds):
+            restart = min(self.start(first), start)
+        else:
+            restart = self.end(first - 1) if first else 0
+
+        lexer = RegexLexer(text)
+        lexer.pos = restart
+        new = TokenBuffer(text)
+        limit = edit_end + RESYNC_WINDOW
+        resync = None
+        while resync is None:
+            lexer.end = min(limit, len(text))
+            final = lexer.end == len(text)
+            checked = len(new)
+            try:
+                error = lexer.scan(new, final)
+            except IllegalCharError as e:
+                error = e
+            if self.error is None:
+                resync = self.find_resync(new, checked, edit_end, delta)
+            if final or error:
+                break
+            limit += max(limit - restart, RESYNC_WINDOW)
+
+        if resync is None:
+            removed, inserted = len(self.kinds) - first, len(new)
+            self.error, self.unterminated = error, lexer.unterminated
+        else:
+            inserted, old_index = resync
+            removed = old_index - first
+        self.kinds[first:first + removed] = new.kinds[:inserted]
+        self.starts[first:first + removed] = array('q', new.starts[:inserted])
+        self.ends[first:first + removed] = array('q', new.ends[:inserted])
+        self.shift_from = first + inserted
+        self.shift += delta
+        return first, removed, inserted
+
+    def find_resync(self, new, checked, edit_end, delta):
+        # First new token past the edit that starts where an old token of the
+        # same kind started; lexing is deterministic from there on.
+        old_count = len(self.kinds)
+        for k in range(checked, len(new)):
+            kind = new.kinds[k]
+            if new.starts[k] < edit_end or kind in (TT_COMMENT, TT_ENDCOMMENT):
+                continue
+            old_start = new.starts[k] - delta
+            index = bisect_left(range(self.shift_from, old_count), old_start, key=self.start) + self.shift_from
+            if index < old_count and self.start(index) == old_start and self.kinds[index] == kind:
+                return k, index
+        return None
+
+    def update(self, text):
+        # Apply whatever single edit turns self.text into `text`
+        prefix = common_prefix(self.text, text)
+        suffix = common_suffix(self.text, text, prefix)
+        if prefix == len(self.text) == len(text):
+            return 0, 0, 0
+        return self.apply_edit(prefix, len(self.text) - suffix, text[prefix:len(text) - suffix])
+
+    def tokens(self):
+        self.settle(len(self.kinds))
+        tokens = TokenBuffer(self.text)
+        tokens.kinds = array('B', self.kinds)
+        tokens.starts = array(tokens.starts.typecode, self.starts)
+        tokens.ends = array(tokens.ends.typecode, self.ends)
+        return tokens
+
+    def result(self):
+        # (tokens, error string) as run_from_code would return for self.text
+        if self.unterminated == TT_STARTCOMMENT:
+            return [], f"An error occurred: {str(self.error)}"
+        return self.tokens(), self.error.as_string() if self.error else None
+
+
+def common_prefix(a, b):
+    n = min(len(a), len(b))
+    pos = 0
+    while pos < n:
+        block = min(DIFF_BLOCK, n - pos)
+        if a[pos:pos + block] == b[pos:pos + block]:
+            pos += block
+            continue
+        while a[pos] == b[pos]:
+            pos += 1
+        break
+    return pos
+
+
+def common_suffix(a, b, prefix):
+    # Longest common suffix that does not overlap the common prefix
+    n = min(len(a), len(b)) - prefix
+    length = 0
+    while length < n:
+        block = min(DIFF_BLOCK, n - length)
+        if a[len(a) - length - block:len(a) - length] == b[len(b) - length - block:len(b) - length]:
+            length += block
+            continue
+        while a[len(a) - length - 1] == b[len(b) - length - 1]:
+            length += 1
+        break
+    return length
+
+
+###############################
+# NODES
+###############################
+
+class NumberNode:
+    __slots__ = ('tok',)
+
+    def __init__(self, tok):
+        self.tok = tok
+
+    def __repr__(self):
+        return f'{repr(self.tok)}'
+
+
+class VarAccessNode:
+    __slots__ = ('tok',)
+
+    def __init__(self, tok):
+        self.tok = tok
+
+    def __repr__(self):
+        return f'{repr(self.tok)}'
+
+
+class StringNode:
+    __slots__ = ('tok',)
+
+    def __init__(self, tok):
+        self.tok = tok
+
+    def __repr__(self):
+        return f'{repr(self.tok)}'
+
+
+class BinOpNode:
+    __slots__ = ('left_node', 'op_tok', 'right_node')
+
+    def __init__(self, left_node, op_tok, right_node):
+        self.left_node = left_node
+        self.op_tok = op_tok
+        self.right_node = right_node
+
+    def __repr__(self):
+        return node_repr(self)
+
+
+class UnaryOpNode:
+    __slots__ = ('op_tok', 'node')
+
+    def __init__(self, op_tok, node):
+        self.op_tok = op_tok
+        self.node = node
+
+    def __repr__(self):
+        return node_repr(self)
+
+
+def node_repr(node):
+    # (left, op, right) and (op, node), built with an explicit stack: the parser
+    # nests trees deeper than the recursion limit, so printing must not recurse
+    parts = []
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif isinstance(item, BinOpNode):
+            stack.extend((')', item.right_node, f', {repr(item.op_tok)}, ', item.left_node, '('))
+        elif isinstance(item, UnaryOpNode):
+            stack.extend((')', item.node, f'{item.op_tok}, ', '('))
+        else:
+            parts.append(repr(item))
+    return ''.join(parts)
+
+
+###############################
+# PARSE RESULT
+###############################
+
+class ParseResult:
+    def __init__(self):
+        self.error = None
+        self.node = None
+
+    def success(self, node):
+        self.node = node
+        return self
+
+    def failure(self, error):
+        self.error = error
+        return self
+
+
+###############################
+# PARSER
+###############################
+
+# Binding powers, higher binds tighter. An infix operator continues the
+# expression on its left while its left power is above the current minimum, and
+# parses its right operand with its right power as the new minimum: equal powers
+# make it left-associative, a right power one lower right-associative.
+INFIX_BINDING_POWERS = {
+    TT_OR:          (1, 1),
+    TT_AND:         (2, 2),
+    TT_EQUIVAL:     (3, 3),
+    TT_NOTEQUAL:    (3, 3),
+    TT_LESS:        (3, 3),
+    TT_GREATER:     (3, 3),
+    TT_LEQUAL:      (3, 3),
+    TT_GEQUAL:      (3, 3),
+    TT_ADD:         (4, 4),
+    TT_SUB:         (4, 4),
+    TT_MUL:         (5, 5),
+    TT_DIV:         (5, 5),
+    TT_MOD:         (5, 5),
+    TT_FLOOR:       (5, 5),
+    TT_EXP:         (7, 6),  # -2 ^ 2 is -(2 ^ 2), 2 ^ 3 ^ 2 is 2 ^ (3 ^ 2)
+}
+
+PREFIX_BINDING_POWERS = {
+    TT_ADD: 6,
+    TT_SUB: 6,
+    TT_NOT: 6,
+}
+
+OPERAND_NODES = {
+    TT_INT: NumberNode,
+    TT_FLOAT: NumberNode,
+    TT_IDENTIFIER: VarAccessNode,
+    TT_STRLITERAL: StringNode,
+}
+
+COMMENT_KINDS = {TT_SINGLECOMMENT, TT_STARTCOMMENT, TT_ENDCOMMENT, TT_COMMENT}
+
+# Parser stack frames
+FRAME_PREFIX, FRAME_INFIX, FRAME_PAREN = range(3)
+
+
+class Parser:
+    # Precedence climbing (Pratt) over the token kinds, with an explicit stack in
+    # place of recursion, so nesting depth is bounded by memory rather than by
+    # Python's recursion limit. `tokens` is a TokenBuffer or a list of Tokens;
+    # comment tokens are skipped.
+    def __init__(self, tokens):
+        self.tokens = tokens
+        kinds = tokens.kinds if hasattr(tokens, 'kinds') else [token.kind for token in tokens]
+        if COMMENT_KINDS.isdisjoint(kinds):
+            self.order = None
+            self.kinds = kinds
+        else:
+            self.order = [i for i, kind in enumerate(kinds) if kind not in COMMENT_KINDS]
+            self.kinds = [kinds[i] for i in self.order]
+        self.tok_idx = 0
+
+    def token(self, index):
+        if self.order is None:
+            return self.tokens[index]
+        return self.tokens[self.order[index]]
+
+    def parse(self):
+        res = ParseResult()
+        node = self.expr()
+        if isinstance(node, Error):
+            return res.failure(node)
+        if self.tok_idx < len(self.kinds):
+            return res.failure(self.syntax_error("Expected an operator"))
+        return res.success(node)
+
+    def syntax_error(self, details):
+        # Spans the current token, or the end of the input once it is used up
+        if self.tok_idx < len(self.kinds):
+            tok = self.token(self.tok_idx)
+            return InvalidSyntaxError(details, tok.start, tok.end)
+        end = self.token(len(self.kinds) - 1).end if self.kinds else 0
+        return InvalidSyntaxError(details, end, end)
+
+    def expr(self):
+        # Returns the expression node starting at tok_idx, or an InvalidSyntaxError
+        kinds = self.kinds
+        count = len(kinds)
+        token = self.tokens.__getitem__ if self.order is None else self.token
+        infix_powers = INFIX_BINDING_POWERS
+        prefix_powers = PREFIX_BINDING_POWERS
+        operand_nodes = OPERAND_NODES
+        stack = []  # (frame type, min power to restore, operator token, left node)
+        min_power = 0
+        i = self.tok_idx
+
+        while True:
+            # Prefix position: open any number of unary operators and parentheses,
+            # then read one operand
+            kind = kinds[i] if i < count else None
+            if kind in prefix_powers:
+                stack.append((FRAME_PREFIX, min_power, token(i), None))
+                min_power = prefix_powers[kind]
+                i += 1
+                continue
+            if kind == TT_LPAREN:
+                stack.append((FRAME_PAREN, min_power, None, None))
+                min_power = 0
+                i += 1
+                continue
+            node_class = operand_nodes.get(kind)
+            if node_class is None:
+                self.tok_idx = i
+                return self.syntax_error("Expected int, float, identifier, string, '+', '-', '!' or '('")
+            left = node_class(token(i))
+            i += 1
+
+            # Infix position: an operator that binds tighter than the current
+            # minimum takes `left` as its left operand; otherwise the innermost
+            # open frame is complete and is folded into `left`
+            while True:
+                kind = kinds[i] if i < count else None
+                powers = infix_powers.get(kind)
+                if powers is not None and powers[0] > min_power:
+                    stack.append((FRAME_INFIX, min_power, token(i), left))
+                    min_power = powers[1]
+                    i += 1
+                    break
+                if not stack:
+                    self.tok_idx = i
+                    return left
+                frame, min_power, op_tok, left_node = stack.pop()
+                if frame == FRAME_INFIX:
+                    left = BinOpNode(left_node, op_tok, left)
+                elif frame == FRAME_PREFIX:
+                    left = UnaryOpNode(op_tok, left)
+                elif kind == TT_RPAREN:
+                    i += 1
+                else:
+                    self.tok_idx = i
+                    return self.syntax_error("Expected ')'")
+
+
+###############################
+# CACHE
+###############################
+
+# Part of every cache key; bump it whenever the token stream for a given input,
+# or the on-disk form of the tokens or errors, changes.
+LEXER_VERSION = 3
+
+# Cache entry layout, little-endian: header (magic, offset typecode, token
+# count, error length or NO_CACHED_ERROR), then the kinds, starts and ends
+# columns as raw arrays, then the UTF-8 error text. Entries are plain data, so
+# reading one from a shared directory cannot run code.
+CACHE_MAGIC = b'SUPPCACH'
+CACHE_HEADER = struct.Struct('<8scxxxQQ')
+NO_CACHED_ERROR = (1 << 64) - 1
+
+
+class TokenCache:
+    # On-disk cache of lexed token columns keyed by a hash of the source text, so
+    # unchanged files are loaded instead of re-lexed. Entries are evicted least
+    # recently used first once the directory grows past max_bytes.
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Oldest first; file mtimes carry the LRU order across processes
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.tokens'):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-len('.tokens')], stat.st_size))
+        self.entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.size = sum(self.entries.values())
+
+    def key(self, text, keep='all'):
+        digest = hashlib.sha256(f'supp-lexer-{LEXER_VERSION}:{keep}:'.encode('ascii'))
+        digest.update(text.encode('utf-8') if isinstance(text, str) else text)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.tokens')
+
+    def get(self, key, text):
+        # Returns (tokens, error) for `text`, or None on a miss
+        try:
+            with open(self.path(key), 'rb') as file:
+                kinds, starts, ends, error = decode_cache_entry(file.read(), len(text))
+            os.utime(self.path(key))
+        except Exception:  # unreadable, truncated or foreign: any failure is a miss
+            self.misses += 1
+            self.entries.pop(key, None)
+            return None
+
+        self.hits += 1
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        tokens = TokenBuffer(text)
+        tokens.kinds, tokens.starts, tokens.ends = kinds, starts, ends
+        return tokens, error
+
+    def put(self, key, tokens, error):
+        data = encode_cache_entry(tokens, error)
+        if len(data) > self.max_bytes:
+            return
+        temp_path = f'{self.path(key)}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, self.path(key))  # readers never see a partial entry
+        except OSError:  # a full disk or read-only directory only costs the cache entry
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        self.size += len(data) - self.entries.pop(key, 0)
+        self.entries[key] = len(data)
+        while self.size > self.max_bytes and self.entries:
+            old_key, old_size = self.entries.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+            try:
+                os.remove(self.path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.size,
+        }
+
+
+def encode_cache_entry(tokens, error):
+    columns = [tokens.kinds, tokens.starts, tokens.ends]
+    if sys.byteorder == 'big':
+        columns = [column if column.itemsize == 1 else byteswapped(column) for column in columns]
+    error_data = error.encode('utf-8') if error is not None else b''
+    header = CACHE_HEADER.pack(CACHE_MAGIC, tokens.starts.typecode.encode('ascii'), len(tokens.kinds),
+                               NO_CACHED_ERROR if error is None else len(error_data))
+    return b''.join([header] + [column.tobytes() for column in columns] + [error_data])
+
+
+def decode_cache_entry(data, text_length):
+    # (kinds, starts, ends, error); raises ValueError for anything malformed
+    magic, typecode, count, error_length = CACHE_HEADER.unpack_from(data)
+    typecode = typecode.decode('ascii')
+    if magic != CACHE_MAGIC or typecode not in ('I', 'Q'):
+        raise ValueError('not a token cache entry')
+    width = array(typecode).itemsize
+    position = CACHE_HEADER.size
+    columns = []
+    for itemsize, column_type in ((1, 'B'), (width, typecode), (width, typecode)):
+        column = array(column_type)
+        column.frombytes(data[position:position + count * itemsize])
+        if len(column) != count:
+            raise ValueError('truncated token cache entry')
+        if sys.byteorder == 'big' and itemsize > 1:
+            column.byteswap()
+        columns.append(column)
+        position += count * itemsize
+
+    error = None
+    if error_length != NO_CACHED_ERROR:
+        error = data[position:position + error_length].decode('utf-8')
+        position += error_length
+    if position != len(data):
+        raise ValueError('token cache entry has the wrong size')
+    kinds, starts, ends = columns
+    if count and max(ends) > text_length:
+        raise ValueError('token cache entry does not fit the text')
+    return kinds, starts, ends, error
+
+
+def byteswapped(column):
+    column = array(column.typecode, column)
+    column.byteswap()
+    return column
 
 
 ###############################
 # RUN
 ###############################
 
-def run(filename):
+LEXERS = {
+    'classic': Lexer,
+    'regex': RegexLexer,
+}
+
+ASCII_SCAN_BLOCK = 1 << 20
+
+def run(filename, engine='classic', cache=None, keep='all', symbols=None):
+    # `symbols`, a SymbolTable, is filled with the file's identifiers and string literals
     try:
         _, file_extension = os.path.splitext(filename)
 
         if file_extension != '.supp':
             return [], f"Error: Unsupported file type '{file_extension}'"
 
-        with open(filename, 'r') as file:
-            text = file.read()
+        lexer_class = LEXERS[engine]
+        check_keep(keep)
+        text = read_source(filename)
+        try:
+            if cache is not None:
+                key = cache.key(text, keep)
+                cached = cache.get(key, text)
+                if cached is not None:
+                    tokens, error = cached
+                    if symbols is not None:
+                        symbols.add_tokens(tokens)
+                    return detach_source(tokens, text), error
+
+            lexer_text = text
+            if not isinstance(text, str) and not lexer_class.byte_level:
+                lexer_text = str(text, 'ascii')
+
+            lexer = lexer_class(lexer_text, keep=keep, symbols=symbols)
+            tokens, error = lexer.make_tokens()
+            error = error.as_string() if error else None
+
+            if cache is not None:
+                cache.put(key, tokens, error)
+            return detach_source(tokens, text), error
+        finally:
+            close_source(text)
 
-        lexer = Lexer(text)
-        tokens, error = lexer.make_tokens()
+    except FileNotFoundError:
+        return [], f"Error: File '{filename}' not found"
+
+
+def read_source(filename):
+    # Map the file read-only. When it is pure ASCII without '\r' the mapping is
+    # exactly what text mode would produce, so it is returned for byte-level
+    # lexing; otherwise decode it as open(filename, 'r') would.
+    with open(filename, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files cannot be mapped
+            return ''
+
+    if is_plain_ascii(data):
+        return data
+    data.close()
+
+    with open(filename, 'r') as file:
+        return file.read()
+
+
+def decode_source(data, byte_level=True):
+    # read_source() for bytes already read from a file: the bytes themselves when
+    # they are plain ASCII and the lexer is byte-level, else decoded as
+    # open(filename, 'r') would decode them
+    if byte_level and is_plain_ascii(data):
+        return data
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+def detach_source(tokens, text):
+    # Lexing reads the file through its mapping, but the returned tokens must
+    # not: values are sliced from tokens.text later, and a file rewritten in the
+    # meantime would change them, or fault once it is truncated. A copy of the
+    # ASCII bytes costs a memcpy and no decoding.
+    if isinstance(text, mmap.mmap) and isinstance(tokens, TokenBuffer) and tokens.text is text:
+        tokens.text = text[:]
+    return tokens
+
+
+def close_source(text):
+    if isinstance(text, mmap.mmap):
+        text.close()
+
+
+def is_plain_ascii(data):
+    # bytes.isascii() runs at memory speed; scan in blocks so only one block is copied at a time
+    for start in range(0, len(data), ASCII_SCAN_BLOCK):
+        block = data[start:start + ASCII_SCAN_BLOCK]
+        if not block.isascii() or b'\r' in block:
+            return False
+    return True
 
-        return tokens, error.as_string() if error else None
+
+def run_parallel(filename, workers=None):
+    # Lex one large file across a process pool. The file is split right after
+    # newlines and every chunk is lexed as if it started in plain code. Only
+    # string literals and /* */ comments can span a newline, and a chunk that
+    # ends inside one reports it as unterminated: it is then lexed again together
+    # with the following chunk. The result matches run(filename, 'regex').
+    try:
+        _, file_extension = os.path.splitext(filename)
+
+        if file_extension != '.supp':
+            return [], f"Error: Unsupported file type '{file_extension}'"
+
+        text = read_source(filename)
+        try:
+            tokens, error = lex_parallel(filename, text, workers)
+            return detach_source(tokens, text), error
+        finally:
+            close_source(text)
 
     except FileNotFoundError:
         return [], f"Error: File '{filename}' not found"
 
 
-def run_from_code(code):
+def lex_parallel(filename, text, workers):
+    # run_parallel() on the already read source: (tokens, error), where
+    # tokens.text is still `text`
+    workers = workers or os.cpu_count() or 1
+    bounds = split_points(text, min(workers * PARALLEL_CHUNKS_PER_WORKER, len(text) // PARALLEL_MIN_CHUNK))
+
+    if workers == 1 or len(bounds) <= 2:
+        results = [lex_chunk(text, 0, len(text))]
+        bounds = [0, len(text)]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            if isinstance(text, str):
+                # Decoded text cannot be shared, so each worker gets its own slice
+                chunks = [text[a:b] for a, b in zip(bounds, bounds[1:])]
+                results = list(pool.map(lex_text_chunk, chunks, bounds[:-1]))
+            else:
+                results = list(pool.map(lex_mapped_chunk, repeat(filename), bounds[:-1], bounds[1:]))
+
+    tokens = TokenBuffer(text)
+    i = 0
+    while i < len(results):
+        kinds, starts, ends, error, unterminated = results[i]
+        j = i + 1
+        if unterminated and j < len(results):
+            # Re-lex up to the chunk holding the closing delimiter. When that
+            # still ends inside a string or comment, the chunks after it all
+            # start in the wrong state: lex the rest in one go.
+            j = min(max(j + 1, bisect_left(bounds, closing_end(text, error.start, unterminated))), len(results))
+            kinds, starts, ends, error, unterminated = lex_chunk(text, bounds[i], bounds[j])
+            if unterminated and j < len(results):
+                j = len(results)
+                kinds, starts, ends, error, unterminated = lex_chunk(text, bounds[i], bounds[j])
+
+        if starts.typecode != tokens.starts.typecode:  # chunk was lexed on its own
+            starts = array(tokens.starts.typecode, starts.tolist())
+            ends = array(tokens.ends.typecode, ends.tolist())
+        tokens.kinds.extend(kinds)
+        tokens.starts.extend(starts)
+        tokens.ends.extend(ends)
+        if unterminated == TT_STARTCOMMENT:
+            raise error  # as Lexer.make_multi_line_comment does
+        if error:
+            return tokens, error.as_string()
+        i = j
+
+    return tokens, None
+
+
+def closing_end(text, start, kind):
+    # Offset just past the delimiter closing the string literal or comment
+    # opened at `start`, or len(text) when nothing closes it
+    if kind == TT_STARTCOMMENT:
+        at = text.find('*/' if isinstance(text, str) else b'*/', start + 2)
+        return len(text) if at < 0 else at + 2
+    at = text.find(text[start:start + 1], start + 1)
+    return len(text) if at < 0 else at + 1
+
+
+PARALLEL_MIN_CHUNK = 1 << 20
+PARALLEL_CHUNKS_PER_WORKER = 4
+
+
+def split_points(text, pieces):
+    # Chunk boundaries for run_parallel: 0, offsets just past a newline, len(text)
+    newline = '\n' if isinstance(text, str) else b'\n'
+    bounds = [0]
+    for i in range(1, max(pieces, 1)):
+        at = text.find(newline, max(len(text) * i // pieces, bounds[-1]))
+        if at < 0:
+            break
+        if at + 1 > bounds[-1]:
+            bounds.append(at + 1)
+    if bounds[-1] < len(text):
+        bounds.append(len(text))
+    return bounds
+
+
+def lex_chunk(text, start, end, offset=0):
+    # Lex text[start:end] with the regex engine. Returns the token columns, with
+    # offsets shifted by `offset`, the error if any, and the kind of a string
+    # literal or comment still open at `end`.
+    lexer = RegexLexer(text, offset)
+    lexer.pos = start
+    lexer.end = end
+    tokens = TokenBuffer(text)
+    try:
+        error = lexer.scan(tokens)
+    except IllegalCharError as e:
+        error = e
+
+    starts, ends = tokens.starts, tokens.ends
+    if offset:
+        starts = array(starts.typecode, [pos + offset for pos in starts])
+        ends = array(ends.typecode, [pos + offset for pos in ends])
+    return tokens.kinds, starts, ends, error, lexer.unterminated
+
+
+def lex_text_chunk(chunk, offset):
+    return lex_chunk(chunk, 0, len(chunk), offset)
+
+
+def lex_mapped_chunk(filename, start, end):
+    with open(filename, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    with data:
+        return lex_chunk(data, start, end)
+
+
+def iter_tokens(file_or_path, chunk_size=1 << 20):
+    # Lex a file chunk by chunk, yielding tokens as they are completed. Only the
+    # unfinished tail of the previous chunk is kept, so memory stays bounded by
+    # chunk_size plus the longest single token. Lexing errors are raised.
+    if isinstance(file_or_path, (str, os.PathLike)):
+        with open(file_or_path, 'r') as file:
+            yield from iter_tokens(file, chunk_size)
+        return
+
+    text = ''
+    offset = 0
+    read_size = chunk_size
+    while True:
+        chunk = file_or_path.read(read_size)
+        final = not chunk
+        lexer = RegexLexer(text + chunk, offset)
+        tokens = TokenBuffer(lexer.text)
+        error = lexer.scan(tokens, final)
+        for token in tokens:
+            token.start += offset
+            token.end += offset
+            yield token
+        if error:
+            raise error
+        if final:
+            return
+
+        # A token longer than the buffer grows the next read instead of
+        # rescanning the same prefix once per chunk.
+        read_size = chunk_size if lexer.pos else max(chunk_size, len(lexer.text))
+        text = lexer.text[lexer.pos:]
+        offset += lexer.pos
+
+
+def run_from_code(code, engine='classic', keep='all', symbols=None):
     try:
-        lexer = Lexer(code)
+        lexer = LEXERS[engine](code, keep=keep, symbols=symbols)
         tokens, error = lexer.make_tokens()
 
         return tokens, error.as_string() if error else None
@@ -431,3 +1746,111 @@ def run_from_code(code):
     except Exception as e:
         return [], f"An error occurred: {str(e)}"
 
+
+def check_code(code, engine='classic'):
+    # Every error in `code` from one pass: (tokens, [Error, ...]), each error
+    # carrying its start/end span
+    return LEXERS[engine](code).make_tokens_recovering()
+
+
+def parse_code(code, engine='classic'):
+    # Lexes and parses `code` as a single expression: (node, error)
+    try:
+        tokens, error = LEXERS[engine](code, keep='code').make_tokens()
+        if error:
+            return None, error.as_string()
+
+        res = Parser(tokens).parse()
+        return res.node, res.error.as_string() if res.error else None
+
+    except Exception as e:
+        return None, f"An error occurred: {str(e)}"
+
+
+###############################
+# BATCH
+###############################
+
+def run_many(paths, workers=None, engine='regex', batch_size=32):
+    # Lex many files in a process pool, yielding (path, tokens, error) as soon as
+    # each batch of files finishes. Batching keeps the per-task IPC overhead low.
+    return map_batches(lex_batch, list(paths), (engine,), workers, batch_size)
+
+
+def map_batches(function, items, args=(), workers=None, batch_size=32, pool=None):
+    # Call function(batch, *args) on consecutive batches of `items` and yield
+    # the entries of the lists it returns, in order of completion. A single
+    # batch, or a single worker, runs in-process; otherwise the batches go to
+    # `pool`, or to a process pool that lasts for this call.
+    workers = workers or os.cpu_count() or 1
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    if workers == 1 or len(batches) <= 1:
+        for batch in batches:
+            yield from function(batch, *args)
+        return
+
+    if pool is None:
+        with ProcessPoolExecutor(workers) as pool:
+            yield from map_batches(function, items, args, workers, batch_size, pool)
+        return
+
+    futures = [pool.submit(function, batch, *args) for batch in batches]
+    for future in as_completed(futures):
+        yield from future.result()
+
+
+def lex_batch(paths, engine):
+    results = []
+    for path in paths:
+        try:
+            tokens, error = run(path, engine)
+        except Exception as e:
+            tokens, error = [], f"An error occurred: {str(e)}"
+        results.append((path, tokens, error))
+    return results
+
+
+def find_supp_files(paths):
+    # Expand directories into the .supp files below them; other paths are kept
+    # as given so run() can report them.
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith('.supp'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Lex SupplyScript files')
+    parser.add_argument('paths', nargs='+', help='.supp files or directories to search for them')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--engine', choices=sorted(LEXERS), default='regex')
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    files = failed = token_count = byte_count = 0
+    for path, tokens, error in run_many(find_supp_files(args.paths), args.workers, args.engine, args.batch_size):
+        files += 1
+        token_count += len(tokens)
+        if tokens:
+            byte_count += len(tokens.text)
+        if error:
+            failed += 1
+            print(f'{path}: {error}')
+
+    elapsed = time.perf_counter() - start
+    print(f'{files} files, {failed} with errors, {token_count} tokens, {byte_count} bytes '
+          f'in {elapsed:.2f}s ({byte_count / max(elapsed, 1e-9) / 1e6:.2f} MB/s)')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
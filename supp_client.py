@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# Deliberately imports nothing from supp: the client only has to start Python,
+# send one request to supp_daemon and print what comes back.
+
+###############################
+# PROTOCOL
+###############################
+
+# A request is one JSON object per line:
+#   {"path": "x.supp"} or {"code": "..."}
+#   optional "engine" ("classic" or "regex"), "keep" ("all", "code" or "spans")
+#   and "format" ("json" or "binary"), all strings
+#   over TCP, also "token": the contents of the daemon's token file
+# A json response is any number of lines, each a JSON array of up to
+# RESPONSE_BATCH [kind, value, start, end] tokens, then a summary line
+# {"count": n, "error": error-or-null}.
+# A binary response is one summary line that also carries "length", followed by
+# that many bytes of the token_stream file format.
+# A connection can carry any number of requests, answered in order.
+
+RESPONSE_BATCH = 1000
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f'supp-lexer-{os.getuid() if hasattr(os, "getuid") else 0}.sock')
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7878
+DEFAULT_TOKEN_FILE = os.path.join(os.path.expanduser('~'), '.supp-lexer-token')
+
+
+###############################
+# CLIENT
+###############################
+
+class LexerClient:
+    def __init__(self, socket_path=DEFAULT_SOCKET, port=DEFAULT_PORT, token_file=DEFAULT_TOKEN_FILE):
+        # Unix socket when the platform has them and the daemon is listening on
+        # one, localhost TCP with the daemon's access token otherwise
+        self.token = None
+        if hasattr(socket, 'AF_UNIX') and os.path.exists(socket_path):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+        else:
+            with open(token_file) as file:
+                self.token = file.read().strip()
+            self.sock = socket.create_connection((DEFAULT_HOST, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.sock.makefile('rb')
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, path=None, code=None, engine='regex', keep='all', format='json'):
+        request = {'engine': engine, 'keep': keep, 'format': format}
+        if path is not None:
+            request['path'] = os.path.abspath(path)  # the daemon has its own working directory
+        else:
+            request['code'] = code
+        if self.token is not None:
+            request['token'] = self.token
+        self.sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+    def lex(self, path=None, code=None, engine='regex', keep='all'):
+        # (tokens, error), tokens as [kind, value, start, end] lists
+        self.send(path, code, engine, keep)
+        tokens = []
+        for line in self.stream:
+            if line.startswith(b'['):
+                tokens.extend(json.loads(line))
+            else:
+                return tokens, json.loads(line)['error']
+        raise ConnectionError('lexer daemon closed the connection')
+
+    def lex_binary(self, path=None, code=None, engine='regex', keep='all'):
+        # (token stream bytes, error)
+        self.send(path, code, engine, keep, format='binary')
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError('lexer daemon closed the connection')
+        summary = json.loads(line)
+        data = self.stream.read(summary.get('length', 0))
+        return data, summary['error']
+
+
+###############################
+# CLI
+###############################
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Lex .supp files through a running supp_daemon')
+    parser.add_argument('paths', nargs='*', help='.supp files (default: read code from stdin)')
+    parser.add_argument('--engine', choices=['classic', 'regex'], default='regex')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--token-file', default=DEFAULT_TOKEN_FILE)
+    parser.add_argument('-o', '--output', help='write the binary token stream here (one input only)')
+    args = parser.parse_args(argv)
+
+    failed = False
+    with LexerClient(args.socket, args.port, args.token_file) as client:
+        if args.output:
+            path = args.paths[0] if args.paths else None
+            data, error = client.lex_binary(path, None if path else sys.stdin.read(), args.engine)
+            with open(args.output, 'wb') as output_file:
+                output_file.write(data)
+            if error:
+                print(error, file=sys.stderr)
+            return 1 if error else 0
+
+        requests = [(path, None) for path in args.paths] or [(None, sys.stdin.read())]
+        for path, code in requests:
+            tokens, error = client.lex(path, code, args.engine)
+            for kind, value, start, end in tokens:
+                print(f"{kind}\t{start}\t{end}\t{value!r}" if value is not None else f"{kind}\t{start}\t{end}")
+            if error:
+                failed = True
+                print(f"{path or '<stdin>'}: {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,236 @@
+import asyncio
+import hmac
+import io
+import json
+import os
+import secrets
+import socket
+from concurrent.futures import ProcessPoolExecutor
+
+import supp
+from supp_client import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_SOCKET, DEFAULT_TOKEN_FILE, RESPONSE_BATCH
+from token_stream import dump_token_stream
+
+# A long-running lexer server: the interpreter, supp and its compiled patterns
+# stay loaded, so a request costs only the lexing itself. The wire protocol is
+# described in supp_client.py.
+#
+# The daemon reads any path its user can read, so it only answers that user.
+# The Unix socket is made accessible to its owner only. Over the TCP fallback,
+# which any local user can connect to, every request must carry the random
+# token the daemon writes to a file only its owner can read (DEFAULT_TOKEN_FILE).
+
+# Inputs up to this size are lexed on the event loop, where a round trip costs
+# less than handing them to a worker process; larger ones go to the pool so
+# they do not hold up the other clients.
+INLINE_LIMIT = 256 * 1024
+REQUEST_LIMIT = 1 << 30  # longest request line, i.e. inline code
+
+
+###############################
+# REQUESTS
+###############################
+
+def lex_request(request):
+    engine = request.get('engine', 'regex')
+    keep = request.get('keep', 'all')
+    if 'path' in request:
+        try:
+            return supp.run(request['path'], engine, keep=keep)
+        except Exception as e:
+            return [], f"An error occurred: {str(e)}"
+    return supp.run_from_code(request.get('code', ''), engine, keep=keep)
+
+
+def encode_response(request):
+    # The whole response as a list of byte chunks
+    tokens, error = lex_request(request)
+
+    if request.get('format') == 'binary':
+        buffer = io.BytesIO()
+        dump_token_stream(tokens, buffer)
+        data = buffer.getvalue()
+        return [summary_line(len(tokens), error, length=len(data)), data]
+
+    chunks = []
+    for i in range(0, len(tokens), RESPONSE_BATCH):
+        batch = [[token.kind.name, token.value, token.start, token.end] for token in tokens[i:i + RESPONSE_BATCH]]
+        chunks.append(json.dumps(batch).encode('utf-8') + b'\n')
+    chunks.append(summary_line(len(tokens), error))
+    return chunks
+
+
+def summary_line(count, error, **fields):
+    return json.dumps({'count': count, 'error': error, **fields}).encode('utf-8') + b'\n'
+
+
+REQUEST_FIELDS = {
+    'path': str,
+    'code': str,
+    'engine': str,
+    'keep': str,
+    'format': str,
+    'token': str,
+}
+
+
+def check_request(request):
+    # What is wrong with a decoded request, or None
+    if not isinstance(request, dict):
+        return 'a request must be a JSON object'
+    for field, value in request.items():
+        if field not in REQUEST_FIELDS:
+            return f"unknown field '{field}'"
+        if not isinstance(value, REQUEST_FIELDS[field]):
+            return f"'{field}' must be a string"
+    if ('path' in request) == ('code' in request):
+        return "a request needs exactly one of 'path' and 'code'"
+    if request.get('engine', 'regex') not in supp.LEXERS:
+        return f"unknown engine '{request['engine']}'"
+    if request.get('keep', 'all') not in supp.KEEP_MODES:
+        return f"unknown keep mode '{request['keep']}'"
+    if request.get('format', 'json') not in ('json', 'binary'):
+        return f"unknown format '{request['format']}'"
+    return None
+
+
+def request_size(request):
+    if 'path' in request:
+        try:
+            return os.path.getsize(request['path'])
+        except OSError:
+            return 0  # answered inline with run()'s own not-found error
+    return len(request.get('code', ''))
+
+
+###############################
+# SERVER
+###############################
+
+class LexerDaemon:
+    def __init__(self, workers=None, inline_limit=INLINE_LIMIT, token=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.token = token  # required in every request when set
+        self.inline_limit = inline_limit
+        self.pool = None
+        self.requests = 0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    async def respond(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return [summary_line(0, f"Error: Bad request: {str(e)}")]
+        problem = check_request(request)
+        if problem is None and self.token is not None and \
+                not hmac.compare_digest(request.get('token', '').encode('utf-8'), self.token.encode('ascii')):
+            problem = 'missing or wrong token'
+        if problem is not None:
+            return [summary_line(0, f"Error: Bad request: {problem}")]
+
+        self.requests += 1
+        if request_size(request) <= self.inline_limit:
+            return encode_response(request)
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, encode_response, request)
+
+    async def handle(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family != getattr(socket, 'AF_UNIX', None):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for chunk in await self.respond(line):
+                    writer.write(chunk)
+                    await writer.drain()  # stream large responses instead of buffering them whole
+        except (ConnectionError, ValueError):
+            pass  # client went away, or sent a request over REQUEST_LIMIT
+        finally:
+            writer.close()
+
+
+async def serve(socket_path=DEFAULT_SOCKET, port=DEFAULT_PORT, tcp=False, workers=None,
+                token_file=DEFAULT_TOKEN_FILE):
+    unix = not tcp and hasattr(socket, 'AF_UNIX')
+    if unix:
+        daemon = LexerDaemon(workers)
+        remove_stale_socket(socket_path)
+        umask = os.umask(0o177)  # the socket is created owner-only, with no window before a chmod
+        try:
+            server = await asyncio.start_unix_server(daemon.handle, socket_path, limit=REQUEST_LIMIT)
+        finally:
+            os.umask(umask)
+    else:
+        daemon = LexerDaemon(workers, token=write_token(token_file))
+        server = await asyncio.start_server(daemon.handle, DEFAULT_HOST, port, limit=REQUEST_LIMIT)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        daemon.close()
+        path = socket_path if unix else token_file
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def write_token(token_file):
+    # A fresh token in a file only the daemon's user can read
+    token = secrets.token_hex(16)
+    if os.path.exists(token_file):
+        os.unlink(token_file)
+    fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as file:
+        file.write(token)
+    return token
+
+
+def remove_stale_socket(socket_path):
+    # A socket file left behind by a daemon that died; refuse to take over a live one
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise RuntimeError(f"A lexer daemon is already listening on '{socket_path}'")
+    finally:
+        probe.close()
+
+
+###############################
+# CLI
+###############################
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve the SupplyScript lexer over a local socket')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket path')
+    parser.add_argument('--tcp', action='store_true',
+                        help=f'listen on {DEFAULT_HOST} instead of a Unix socket; clients must present the token '
+                             f'from --token-file')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--token-file', default=DEFAULT_TOKEN_FILE, help='where the TCP access token is written')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes for large inputs')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.socket, args.port, args.tcp, args.workers, args.token_file))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import sqlite3
+
+import supp
+
+###############################
+# SCHEMA
+###############################
+
+# Token kinds that get postings, with the number of delimiter characters
+# stripped from each end of their source text
+INDEXED_KINDS = {
+    supp.TT_IDENTIFIER: 0,
+    supp.TT_CLASSTYPE: 0,
+    supp.TT_ATTRIBUTE: 0,
+    supp.TT_STRLITERAL: 1,
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    UNIQUE (name, kind)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (term_id, file_id, offset)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_by_file ON postings (file_id);
+'''
+
+
+###############################
+# LEXING
+###############################
+
+def file_postings(path, old_hash=None, engine='regex'):
+    # Stat, hash and lex one file. Returns (path, mtime_ns, size, hash, error,
+    # postings), where postings is a list of (kind, name, offset), or None
+    # when the content still matches old_hash and nothing needs re-indexing.
+    stat = os.stat(path)
+    with open(path, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == old_hash:
+        return path, stat.st_mtime_ns, stat.st_size, digest, None, None
+
+    # Lex the bytes just hashed, so the postings describe the hashed content,
+    # in recovering mode so the tokens after a bad line are indexed too
+    lexer_class = supp.LEXERS[engine]
+    try:
+        text = supp.decode_source(data, lexer_class.byte_level)
+    except Exception as e:  # not valid UTF-8
+        return path, stat.st_mtime_ns, stat.st_size, digest, f"An error occurred: {str(e)}", []
+    tokens, errors = lexer_class(text).make_tokens_recovering()
+
+    postings = []
+    for kind, start, end in zip(tokens.kinds, tokens.starts, tokens.ends):
+        strip = INDEXED_KINDS.get(kind)
+        if strip is not None:
+            name = text[start + strip:end - strip]
+            if not isinstance(name, str):
+                name = name.decode('ascii')
+            postings.append((kind, name, start))
+    error = '\n'.join(error.as_string() for error in errors) or None
+    return path, stat.st_mtime_ns, stat.st_size, digest, error, postings
+
+
+def postings_batch(jobs, engine):
+    results = []
+    for path, old_hash in jobs:
+        try:
+            results.append(file_postings(path, old_hash, engine))
+        except OSError:
+            pass  # gone or unreadable since the scan; picked up on the next update
+        except Exception as e:
+            results.append((path, 0, 0, '', f"An error occurred: {str(e)}", []))
+    return results
+
+
+###############################
+# INDEX
+###############################
+
+class SymbolIndex:
+    # Persistent inverted index from identifier, class type, attribute and
+    # string literal spellings to (file, offset) postings, kept in SQLite.
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.term_ids = {}
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ###############################
+    # UPDATES
+    ###############################
+
+    def update(self, paths, workers=None, engine='regex', batch_size=32):
+        # Bring the index up to date for the given files and directory trees.
+        # Files whose mtime and size are unchanged are skipped without being
+        # read; the rest are hashed and only re-lexed when the hash differs.
+        # Indexed files under a given directory that no longer exist are
+        # dropped. Returns (reindexed, unchanged, removed) counts.
+        roots = [os.path.abspath(path) for path in paths]
+        found = [os.path.abspath(path) for path in supp.find_supp_files(roots)
+                 if path.endswith('.supp') and os.path.isfile(path)]
+        known = {path: (file_id, mtime_ns, size, digest)
+                 for file_id, path, mtime_ns, size, digest in
+                 self.db.execute('SELECT id, path, mtime_ns, size, hash FROM files')}
+
+        jobs = []
+        unchanged = 0
+        for path in found:
+            old = known.get(path)
+            if old is not None:
+                stat = os.stat(path)
+                if (stat.st_mtime_ns, stat.st_size) == old[1:3]:
+                    unchanged += 1
+                    continue
+            jobs.append((path, old[3] if old else None))
+
+        reindexed = 0
+        results = supp.map_batches(postings_batch, jobs, (engine,), workers, batch_size)
+        try:
+            with self.db:
+                for path, mtime_ns, size, digest, error, postings in results:
+                    if postings is None:
+                        unchanged += 1
+                        self.db.execute('UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?', (mtime_ns, size, path))
+                        continue
+                    self.store(path, mtime_ns, size, digest, error, postings)
+                    reindexed += 1
+
+                found_set = set(found)
+                gone = [path for path in known if path not in found_set and under_roots(path, roots)]
+                for path in gone:
+                    self.remove(path)
+        except BaseException:
+            self.term_ids.clear()  # ids handed out in the rolled back transaction
+            raise
+        return reindexed, unchanged, len(gone)
+
+    def store(self, path, mtime_ns, size, digest, error, postings):
+        row = self.db.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            file_id = self.db.execute('INSERT INTO files (path, mtime_ns, size, hash, error) VALUES (?, ?, ?, ?, ?)',
+                                      (path, mtime_ns, size, digest, error)).lastrowid
+        else:
+            file_id = row[0]
+            self.db.execute('UPDATE files SET mtime_ns = ?, size = ?, hash = ?, error = ? WHERE id = ?',
+                            (mtime_ns, size, digest, error, file_id))
+            self.db.execute('DELETE FROM postings WHERE file_id = ?', (file_id,))
+
+        term_id = self.term_id
+        self.db.executemany('INSERT INTO postings (term_id, file_id, offset) VALUES (?, ?, ?)',
+                            [(term_id(kind, name), file_id, offset) for kind, name, offset in postings])
+
+    def remove(self, path):
+        row = self.db.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row is not None:
+            self.db.execute('DELETE FROM postings WHERE file_id = ?', row)
+            self.db.execute('DELETE FROM files WHERE id = ?', row)
+
+    def term_id(self, kind, name):
+        key = (kind, name)
+        term_id = self.term_ids.get(key)
+        if term_id is None:
+            self.db.execute('INSERT OR IGNORE INTO terms (name, kind) VALUES (?, ?)', (name, int(kind)))
+            term_id, = self.db.execute('SELECT id FROM terms WHERE name = ? AND kind = ?', (name, int(kind))).fetchone()
+            self.term_ids[key] = term_id
+        return term_id
+
+    ###############################
+    # QUERIES
+    ###############################
+
+    def postings(self, name, kind=None):
+        # (path, offset) of every occurrence of `name`, optionally of one token kind
+        query = ('SELECT files.path, postings.offset FROM terms '
+                 'JOIN postings ON postings.term_id = terms.id '
+                 'JOIN files ON files.id = postings.file_id '
+                 'WHERE terms.name = ?')
+        params = [name]
+        if kind is not None:
+            query += ' AND terms.kind = ?'
+            params.append(int(kind))
+        return self.db.execute(query + ' ORDER BY files.path, postings.offset', params).fetchall()
+
+    def files(self, name, kind=None):
+        # Paths of the files that mention `name`
+        query = ('SELECT DISTINCT files.path FROM terms '
+                 'JOIN postings ON postings.term_id = terms.id '
+                 'JOIN files ON files.id = postings.file_id '
+                 'WHERE terms.name = ?')
+        params = [name]
+        if kind is not None:
+            query += ' AND terms.kind = ?'
+            params.append(int(kind))
+        return [path for path, in self.db.execute(query + ' ORDER BY files.path', params)]
+
+
+def under_roots(path, roots):
+    return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+
+###############################
+# CLI
+###############################
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cross-file index of SupplyScript identifiers and literals')
+    parser.add_argument('index', help='index database file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='index new and changed .supp files')
+    update.add_argument('paths', nargs='+', help='.supp files or directories to search for them')
+    update.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    update.add_argument('--engine', choices=sorted(supp.LEXERS), default='regex')
+
+    query = commands.add_parser('query', help='list the uses of a name')
+    query.add_argument('name')
+    query.add_argument('--kind', choices=[supp.TokenKind(kind).name for kind in INDEXED_KINDS], default=None)
+    query.add_argument('--files', action='store_true', help='only list the files that use the name')
+    args = parser.parse_args(argv)
+
+    with SymbolIndex(args.index) as index:
+        if args.command == 'update':
+            reindexed, unchanged, removed = index.update(args.paths, args.workers, args.engine)
+            print(f'{reindexed} files indexed, {unchanged} unchanged, {removed} removed')
+            return 0
+
+        kind = supp.TokenKind[args.kind] if args.kind else None
+        if args.files:
+            results = index.files(args.name, kind)
+            for path in results:
+                print(path)
+        else:
+            results = index.postings(args.name, kind)
+            for path, offset in results:
+                print(f'{path}:{offset}')
+        return 0 if results else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
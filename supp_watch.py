@@ -0,0 +1,167 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import supp
+
+###############################
+# LEXING
+###############################
+
+def lex_changed(path, old_hash, engine):
+    # Returns (path, mtime_ns, size, hash, tokens, error); tokens and error are
+    # None when the content still matches old_hash (only the mtime moved).
+    stat = os.stat(path)
+    with open(path, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == old_hash:
+        return path, stat.st_mtime_ns, stat.st_size, digest, None, None
+
+    # Lex the bytes just hashed rather than the file: the stored tokens then own
+    # their source, and cannot see (or fault on) later rewrites of the file
+    try:
+        text = supp.decode_source(data, supp.LEXERS[engine].byte_level)
+    except Exception as e:  # not valid UTF-8, e.g. a half-written save
+        return path, stat.st_mtime_ns, stat.st_size, digest, [], f"An error occurred: {str(e)}"
+    tokens, error = supp.run_from_code(text, engine)
+    return path, stat.st_mtime_ns, stat.st_size, digest, tokens, error
+
+
+def lex_changed_batch(jobs, engine):
+    results = []
+    for path, old_hash in jobs:
+        try:
+            results.append(lex_changed(path, old_hash, engine))
+        except OSError:
+            pass  # removed or unreadable since the scan; the next poll sees it
+        except Exception as e:
+            results.append((path, None, None, None, [], f"An error occurred: {str(e)}"))
+    return results
+
+
+###############################
+# WATCHER
+###############################
+
+class Watcher:
+    # Keeps the latest (tokens, error) of every .supp file under `paths`.
+    # Each poll() stats the tree, hashes the files whose mtime or size moved and
+    # re-lexes only those whose content actually changed, in a process pool that
+    # stays up between polls. Other tools read `results` or snapshot().
+    def __init__(self, paths, workers=None, engine='regex', batch_size=8):
+        self.roots = [os.path.abspath(path) for path in paths]
+        self.workers = workers or os.cpu_count() or 1
+        self.engine = engine
+        self.batch_size = batch_size
+        self.pool = None
+        self.results = {}   # path -> (tokens, error)
+        self.stats = {}     # path -> (mtime_ns, size)
+        self.hashes = {}    # path -> sha256 hex digest
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def result(self, path):
+        return self.results.get(os.path.abspath(path))
+
+    def snapshot(self):
+        return dict(self.results)
+
+    def errors(self):
+        return {path: error for path, (_, error) in self.results.items() if error}
+
+    def poll(self):
+        # One scan of the tree. Returns (changed, removed) lists of paths.
+        jobs = []
+        found = set()
+        for path in supp.find_supp_files(self.roots):
+            if not path.endswith('.supp'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            path = os.path.abspath(path)
+            found.add(path)
+            if self.stats.get(path) != (stat.st_mtime_ns, stat.st_size):
+                jobs.append((path, self.hashes.get(path)))
+
+        changed = []
+        for path, mtime_ns, size, digest, tokens, error in self.run_jobs(jobs):
+            self.stats[path] = (mtime_ns, size)
+            if tokens is None:
+                continue
+            self.hashes[path] = digest
+            self.results[path] = (tokens, error)
+            changed.append(path)
+
+        removed = [path for path in self.results if path not in found]
+        for path in removed:
+            del self.results[path]
+            self.stats.pop(path, None)
+            self.hashes.pop(path, None)
+        return sorted(changed), removed
+
+    def run_jobs(self, jobs):
+        # A save usually touches one file: lex small change sets in-process and
+        # only hand larger ones to the pool, which stays up between polls
+        if self.pool is None and self.workers > 1 and len(jobs) > self.batch_size:
+            self.pool = ProcessPoolExecutor(self.workers)
+        return supp.map_batches(lex_changed_batch, jobs, (self.engine,), self.workers, self.batch_size, self.pool)
+
+    def watch(self, interval=0.5, on_change=None):
+        # Poll forever, calling on_change(watcher, changed, removed) after every
+        # poll that found something
+        while True:
+            changed, removed = self.poll()
+            if on_change is not None and (changed or removed):
+                on_change(self, changed, removed)
+            time.sleep(interval)
+
+
+###############################
+# CLI
+###############################
+
+def report(watcher, changed, removed):
+    for path in changed:
+        tokens, error = watcher.results[path]
+        if error:
+            print(f"{path}: {error}")
+        else:
+            print(f"{path}: {len(tokens)} tokens")
+    for path in removed:
+        print(f"{path}: removed")
+    print(f"-- {len(watcher.results)} files, {len(watcher.errors())} with errors", flush=True)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-lex .supp files as they change')
+    parser.add_argument('paths', nargs='+', help='.supp files or directories to watch')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--engine', choices=sorted(supp.LEXERS), default='regex')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between polls')
+    args = parser.parse_args(argv)
+
+    with Watcher(args.paths, args.workers, args.engine) as watcher:
+        try:
+            watcher.watch(args.interval, report)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
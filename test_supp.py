@@ -0,0 +1,408 @@
+import io
+import os
+import random
+
+import pytest
+
+import supp
+from supp_index import SymbolIndex
+from supp_watch import Watcher
+from token_stream import TokenStreamReader, dump_token_stream, export_symbol_table, write_token_stream
+
+###############################
+# HELPERS
+###############################
+
+PIECES = ['Product', 'Supplier', 'Order', 'name', 'quantity', 'execute', 'exec', 'updateInventory',
+          'optimizeInventoryLevels', 'update', 'foo', 'x1', 'a_b$', '_', '$', '12', '3.5', '1.2.3', '.',
+          ' ', '  ', '\t', '\n', '//', '/*', '*/', '/', '*', '/.', '+', '-', '%', '^', '=', '==', '!', '!=',
+          '<', '<=', '>', '>=', '&', '&&', '|', '||', ';', ':', '(', ')', '{', '}', '"', "'", 'hello',
+          '@', '#', '₱', '`', '~', '\r', 'é', '?', ',']
+
+
+def random_code(rng, max_pieces=40):
+    return ''.join(rng.choice(PIECES) for _ in range(rng.randint(0, max_pieces)))
+
+
+def token_tuples(tokens):
+    return [(token.kind, token.value, token.start, token.end) for token in tokens]
+
+
+def lexed(code, engine):
+    tokens, error = supp.run_from_code(code, engine=engine)
+    return token_tuples(tokens), error
+
+
+###############################
+# ENGINES
+###############################
+
+@pytest.mark.parametrize('seed', range(4))
+def test_regex_engine_matches_classic(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        code = random_code(rng)
+        assert lexed(code, 'regex') == lexed(code, 'classic'), code
+
+
+@pytest.mark.parametrize('code', [
+    '',
+    'Product p = "Widget";',
+    'x /* open',
+    '"unterminated\nstring',
+    'a // comment\nb',
+    'quantity >= 3.5 && !done || x /. 2',
+    '₱ @ #',
+])
+def test_regex_engine_matches_classic_on_edge_cases(code):
+    assert lexed(code, 'regex') == lexed(code, 'classic')
+
+
+###############################
+# PARALLEL LEXING
+###############################
+
+def outcome(fn, *args, **kwargs):
+    try:
+        tokens, error = fn(*args, **kwargs)
+    except Exception as e:
+        return 'raised', type(e).__name__, str(e)
+    return token_tuples(tokens), error
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_run_parallel_matches_run(tmp_path, monkeypatch, workers):
+    monkeypatch.setattr(supp, 'PARALLEL_MIN_CHUNK', 4)
+    rng = random.Random(workers)
+    path = str(tmp_path / 'input.supp')
+    for _ in range(40):
+        code = random_code(rng, 120)
+        if rng.random() < 0.5:
+            code = code.replace('é', '').replace('₱', '').replace('\r', '')
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(code)
+        assert outcome(supp.run_parallel, path, workers) == outcome(supp.run, path, 'regex'), code
+
+
+###############################
+# STREAMING
+###############################
+
+def streamed(path, chunk_size):
+    tokens = []
+    try:
+        for token in supp.iter_tokens(path, chunk_size=chunk_size):
+            tokens.append(token)
+    except supp.IllegalCharError as e:
+        return token_tuples(tokens), e
+    return token_tuples(tokens), None
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7])
+def test_iter_tokens_matches_run(tmp_path, chunk_size):
+    rng = random.Random(chunk_size)
+    path = str(tmp_path / 'input.supp')
+    for _ in range(300):
+        code = random_code(rng)
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(code)
+        tokens, raised = streamed(path, chunk_size)
+        expected = outcome(supp.run, path, 'regex')
+        if expected[0] == 'raised':  # run() raises for an unterminated comment
+            assert raised is not None and str(raised) == expected[2], code
+        elif raised is None:
+            assert (tokens, None) == expected, code
+        else:
+            assert (tokens, raised.as_string()) == expected, code
+
+
+###############################
+# TOKEN CACHE
+###############################
+
+def symbol_rows(symbols):
+    return [(kind, name, list(offsets)) for _, kind, name, offsets in symbols]
+
+
+@pytest.mark.parametrize('engine', ['classic', 'regex'])
+def test_cache_hit_matches_miss(tmp_path, engine):
+    cache = supp.TokenCache(str(tmp_path / 'cache'))
+    rng = random.Random(5)
+    for n in range(60):
+        path = str(tmp_path / f'input{n}.supp')
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(random_code(rng))
+        expected_symbols = supp.SymbolTable()
+        expected = outcome(supp.run, path, engine, symbols=expected_symbols)
+        for _ in range(2):  # a miss, then a hit
+            symbols = supp.SymbolTable()
+            assert outcome(supp.run, path, engine, cache, symbols=symbols) == expected
+            assert symbol_rows(symbols) == symbol_rows(expected_symbols)
+    assert cache.hits > 0 and cache.misses > 0
+
+
+def test_cache_keys_on_keep(tmp_path):
+    cache = supp.TokenCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'input.supp')
+    with open(path, 'w') as file:
+        file.write('x = 1; // note\n/* block */ y')
+    for keep in ['all', 'code', 'spans', 'all', 'code', 'spans']:
+        assert outcome(supp.run, path, 'regex', cache, keep) == outcome(supp.run, path, 'regex', keep=keep)
+    assert cache.stats()['hits'] == 3
+
+
+def test_cache_treats_truncated_entries_as_misses(tmp_path):
+    cache = supp.TokenCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'input.supp')
+    with open(path, 'w') as file:
+        file.write('Product p = "Widget"; quantity >= 3.5;')
+    expected = outcome(supp.run, path, 'regex', cache)
+    key = cache.key((tmp_path / 'input.supp').read_bytes())
+    with open(cache.path(key), 'rb') as file:
+        data = file.read()
+    for length in [0, 10, len(data) - 1]:
+        with open(cache.path(key), 'wb') as file:
+            file.write(data[:length])
+        misses = cache.misses
+        assert outcome(supp.run, path, 'regex', cache) == expected
+        assert cache.misses == misses + 1
+    assert outcome(supp.run, path, 'regex', cache) == expected
+    assert cache.hits == 1
+
+
+def test_cache_evicts_least_recently_used_first(tmp_path):
+    directory = str(tmp_path / 'cache')
+    paths = []
+    for name in 'abcd':
+        path = str(tmp_path / f'{name}.supp')
+        with open(path, 'w') as file:
+            file.write(f'{name} = 1;')
+        paths.append(path)
+    entry_size = len(supp.encode_cache_entry(*supp.run(paths[0], 'regex')))
+
+    cache = supp.TokenCache(directory, max_bytes=3 * entry_size)
+    a, b, c, d = paths
+    for path in (a, b, c, a, d):  # the hit on a makes b the oldest
+        supp.run(path, 'regex', cache)
+    assert cache.evictions == 1
+    keys = {name: cache.key((tmp_path / f'{name}.supp').read_bytes()) for name in 'abcd'}
+    assert not os.path.exists(cache.path(keys['b']))
+    assert all(os.path.exists(cache.path(keys[name])) for name in 'acd')
+    assert supp.TokenCache(directory).size == 3 * entry_size
+
+
+###############################
+# TOKEN STREAMS
+###############################
+
+@pytest.mark.parametrize('seed', range(3))
+def test_token_stream_round_trip(tmp_path, seed):
+    rng = random.Random(seed)
+    path = str(tmp_path / 'tokens.bin')
+    for _ in range(50):
+        code = random_code(rng, 80).replace('\r', '')
+        tokens, error = supp.run_from_code(code, engine='regex')
+        write_token_stream(path, tokens)
+        with TokenStreamReader(path) as reader:
+            assert len(reader) == len(tokens)
+            assert token_tuples(reader) == token_tuples(tokens), code
+            if tokens:
+                assert token_tuples([reader[-1]]) == token_tuples(tokens[-1:])
+
+
+def test_dump_token_stream_matches_file(tmp_path):
+    tokens, _ = supp.run_from_code('Product p = "Widget ₱";\nquantity >= 3.5;', engine='regex')
+    path = str(tmp_path / 'tokens.bin')
+    write_token_stream(path, tokens)
+    buffer = io.BytesIO()
+    dump_token_stream(tokens, buffer)
+    with open(path, 'rb') as file:
+        assert file.read() == buffer.getvalue()
+
+
+def test_token_stream_reader_rejects_other_files(tmp_path):
+    path = tmp_path / 'not_tokens.bin'
+    path.write_bytes(b'\0' * 256)
+    with pytest.raises(ValueError):
+        TokenStreamReader(str(path))
+
+
+def test_export_symbol_table_from_reader(tmp_path):
+    tokens, _ = supp.run_from_code('Product p = "Widget";\n' * 10, engine='regex')
+    write_token_stream(str(tmp_path / 'tokens.bin'), tokens)
+    output_path = str(tmp_path / 'symbol_table.txt')
+    counts = []
+    with TokenStreamReader(str(tmp_path / 'tokens.bin')) as reader:
+        assert export_symbol_table(reader, output_path, 16, counts.append)
+    assert counts == list(range(16, len(tokens), 16)) + [len(tokens)]
+    with open(output_path) as file:
+        assert file.read() == ''.join(f'{token}\n' for token in tokens)
+
+    assert not export_symbol_table(tokens, output_path, 16, lambda count: False)
+    with open(output_path) as file:
+        assert len(file.readlines()) == 16
+
+
+###############################
+# INCREMENTAL LEXING
+###############################
+
+def check_incremental(lexer, code):
+    tokens, error = lexer.result()
+    assert (token_tuples(tokens), error) == lexed(code, 'regex'), code
+    buffer = lexer.tokens()
+    assert [(lexer.start(i), lexer.end(i)) for i in range(len(lexer))] == \
+        list(zip(buffer.starts, buffer.ends))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_incremental_lexer_matches_full_relex(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        code = random_code(rng)
+        lexer = supp.IncrementalLexer(code)
+        check_incremental(lexer, code)
+        for _ in range(10):
+            start = rng.randint(0, len(code))
+            end = rng.randint(start, min(len(code), start + rng.choice([0, 1, 3, 10])))
+            inserted = random_code(rng, rng.choice([0, 1, 2, 5]))
+            new_code = code[:start] + inserted + code[end:]
+            if rng.random() < 0.5:
+                lexer.apply_edit(start, end, inserted)
+            else:
+                lexer.update(new_code)
+            code = new_code
+            check_incremental(lexer, code)
+
+
+###############################
+# PARSER
+###############################
+
+def shape(node):
+    if isinstance(node, supp.BinOpNode):
+        return f'({shape(node.left_node)} {node.op_tok.kind.name} {shape(node.right_node)})'
+    if isinstance(node, supp.UnaryOpNode):
+        return f'({node.op_tok.kind.name} {shape(node.node)})'
+    return str(node.tok.value)
+
+
+def parsed(code, engine='regex'):
+    node, error = supp.parse_code(code, engine)
+    assert error is None, error
+    return shape(node)
+
+
+@pytest.mark.parametrize('code, expected', [
+    ('1 + 2 * 3', '(1 ADD (2 MUL 3))'),
+    ('1 * 2 + 3', '((1 MUL 2) ADD 3)'),
+    ('(1 + 2) * 3', '((1 ADD 2) MUL 3)'),
+    ('a < b + 1 && c', '((a LESS (b ADD 1)) AND c)'),
+    ('a || b && c', '(a OR (b AND c))'),
+    ('-2 ^ 2', '(SUB (2 EXP 2))'),
+    ('!x == y', '((NOT x) EQUIVAL y)'),
+    ('x /. 2.5 % 3', '((x FLOOR 2.5) MOD 3)'),
+])
+def test_parser_precedence(code, expected):
+    assert parsed(code) == expected
+
+
+@pytest.mark.parametrize('code, expected', [
+    ('1 - 2 - 3', '((1 SUB 2) SUB 3)'),
+    ('8 / 4 / 2', '((8 DIV 4) DIV 2)'),
+    ('a == b != c', '((a EQUIVAL b) NOTEQUAL c)'),
+    ('a || b || c', '((a OR b) OR c)'),
+    ('2 ^ 3 ^ 2', '(2 EXP (3 EXP 2))'),
+    ('- - x', '(SUB (SUB x))'),
+])
+def test_parser_associativity(code, expected):
+    assert parsed(code) == expected
+
+
+def test_parser_engines_and_comments_agree():
+    code = '-2 ^ 2 ^ 3 * 4 - 1 - 2 && !x || y >= 3'
+    expected = '((((((SUB (2 EXP (2 EXP 3))) MUL 4) SUB 1) SUB 2) AND (NOT x)) OR (y GEQUAL 3))'
+    assert parsed(code, 'classic') == parsed(code, 'regex') == expected
+    tokens, _ = supp.run_from_code(f'/* lead */ {code} // trail\n', engine='regex')
+    assert shape(supp.Parser(tokens).parse().node) == expected
+
+
+EXPECTED_OPERAND = "Expected int, float, identifier, string, '+', '-', '!' or '('"
+
+
+@pytest.mark.parametrize('code, details, span', [
+    ('', EXPECTED_OPERAND, (0, 0)),
+    ('1 +', EXPECTED_OPERAND, (3, 3)),
+    (')', EXPECTED_OPERAND, (0, 1)),
+    ('1 + * 2', EXPECTED_OPERAND, (4, 5)),
+    ('(1 + 2', "Expected ')'", (6, 6)),
+    ('1 2', 'Expected an operator', (2, 3)),
+    ('(1))', 'Expected an operator', (3, 4)),
+    ('a = 1', 'Expected an operator', (2, 3)),
+])
+def test_parser_errors(code, details, span):
+    tokens, _ = supp.run_from_code(code, engine='regex')
+    error = supp.Parser(tokens).parse().error
+    assert isinstance(error, supp.InvalidSyntaxError)
+    assert error.details == details
+    assert (error.start, error.end) == span
+    assert supp.parse_code(code) == (None, f'Invalid Syntax{details}')
+
+
+def test_parse_code_reports_lexer_errors():
+    node, error = supp.parse_code('1 + /* open')
+    assert node is None
+    assert error.startswith('An error occurred: Unterminated multi-line comment')
+
+
+def test_parser_handles_nesting_past_the_recursion_limit():
+    depth = 5000
+    node, error = supp.parse_code('(' * depth + '1' + ')' * depth + ' + ' + '-' * depth + 'x', 'regex')
+    assert error is None
+    assert isinstance(node, supp.BinOpNode)
+    assert repr(node).count('(') >= depth
+
+
+###############################
+# WATCHER
+###############################
+
+def test_watcher_reports_undecodable_files(tmp_path):
+    (tmp_path / 'bad.supp').write_bytes(b'x = 1;\n\xff\xfe')
+    (tmp_path / 'good.supp').write_text('Product p;')
+    with Watcher([str(tmp_path)], workers=1) as watcher:
+        changed, removed = watcher.poll()
+        assert [os.path.basename(path) for path in changed] == ['bad.supp', 'good.supp']
+        tokens, error = watcher.result(str(tmp_path / 'bad.supp'))
+        assert tokens == [] and error.startswith('An error occurred:')
+        assert watcher.result(str(tmp_path / 'good.supp'))[1] is None
+        assert watcher.poll() == ([], [])
+
+
+###############################
+# SYMBOL INDEX
+###############################
+
+def test_symbol_index_records_undecodable_files(tmp_path):
+    (tmp_path / 'bad.supp').write_bytes(b'Product p;\n\xff\xfe')
+    (tmp_path / 'good.supp').write_text('Product stock = "Widget";')
+    with SymbolIndex(str(tmp_path / 'index.db')) as index:
+        assert index.update([str(tmp_path)], workers=1) == (2, 0, 0)
+        error, = index.db.execute("SELECT error FROM files WHERE path LIKE '%bad.supp'").fetchone()
+        assert error.startswith('An error occurred:')
+        assert index.files('stock') == [str(tmp_path / 'good.supp')]
+
+
+def test_symbol_index_forgets_term_ids_of_a_failed_update(tmp_path, monkeypatch):
+    (tmp_path / 'a.supp').write_text('Product stock;')
+    with SymbolIndex(str(tmp_path / 'index.db')) as index:
+        def fail(path):
+            raise RuntimeError('interrupted')
+        monkeypatch.setattr(index, 'remove', fail)
+        index.db.execute("INSERT INTO files (path, mtime_ns, size, hash) VALUES ('/gone/x.supp', 0, 0, '')")
+        with pytest.raises(RuntimeError):
+            index.update([str(tmp_path), '/gone'], workers=1)
+        assert index.term_ids == {}
+        monkeypatch.undo()
+        index.update([str(tmp_path)], workers=1)
+        assert index.postings('stock') == [(str(tmp_path / 'a.supp'), 8)]
@@ -0,0 +1,187 @@
+import mmap
+import struct
+import sys
+from array import array
+
+from supp import Token, TokenKind, VALUE_SLICES, token_value
+
+###############################
+# FORMAT
+###############################
+
+# Little-endian file layout, every section aligned to 8 bytes:
+#   header      magic, version, offset width, string count, token count and
+#               the file offset of each section below
+#   kinds       one byte per token
+#   starts      one offset per token (4 or 8 bytes)
+#   ends        one offset per token
+#   values      one uint32 string id per token, NO_VALUE when it has none
+#   pool index  string count + 1 uint64 offsets into the pool data
+#   pool data   the interned token values, UTF-8 encoded
+
+MAGIC = b'SUPPTOKS'
+VERSION = 1
+HEADER = struct.Struct('<8sHBxIQ6Q')
+NO_VALUE = 0xFFFFFFFF
+
+
+def align(n):
+    return (n + 7) & ~7
+
+
+###############################
+# WRITER
+###############################
+
+def write_token_stream(path, tokens):
+    # `tokens` is a TokenBuffer, whose columns are written as they are, or any
+    # iterable of Token objects.
+    with open(path, 'wb') as file:
+        dump_token_stream(tokens, file)
+
+
+def dump_token_stream(tokens, file):
+    # Writes the token stream to an empty, seekable binary file object
+    if hasattr(tokens, 'kinds'):
+        kinds, starts, ends = tokens.kinds, tokens.starts, tokens.ends
+        text = tokens.text
+        values = (token_value(text, kind, start, end) if kind in VALUE_SLICES else None
+                  for kind, start, end in zip(kinds, starts, ends))
+    else:
+        tokens = list(tokens)
+        kinds = array('B', [token.kind for token in tokens])
+        starts = array('Q', [token.start or 0 for token in tokens])
+        ends = array('Q', [token.end or 0 for token in tokens])
+        values = (token.value for token in tokens)
+
+    pool = {}
+    value_ids = array('I', [NO_VALUE if value is None else pool.setdefault(value, len(pool))
+                            for value in values])
+
+    encoded = [value.encode('utf-8') for value in pool]
+    pool_index = array('Q', [0])
+    for data in encoded:
+        pool_index.append(pool_index[-1] + len(data))
+
+    width = starts.itemsize
+    columns = [kinds, starts, ends, value_ids, pool_index]
+    if sys.byteorder == 'big':
+        columns = [column if column.itemsize == 1 else swapped(column) for column in columns]
+
+    sections = []
+    position = align(HEADER.size)
+    for column in columns:
+        sections.append(position)
+        position = align(position + len(column) * column.itemsize)
+    sections.append(position)
+
+    file.write(HEADER.pack(MAGIC, VERSION, width, len(pool), len(kinds), *sections))
+    for column, section in zip(columns, sections):
+        file.seek(section)
+        column.tofile(file)
+    file.seek(sections[-1])
+    file.write(b''.join(encoded))
+
+
+def swapped(column):
+    column = array(column.typecode, column)
+    column.byteswap()
+    return column
+
+
+###############################
+# READER
+###############################
+
+class TokenStreamReader:
+    # Memory-maps a token stream file. Columns are memoryviews over the mapping,
+    # so token N is read directly without parsing the tokens before it.
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, width, self.string_count, count, *sections = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"'{path}' is not a token stream file")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported token stream version {version}")
+        if sys.byteorder != 'little':
+            self.close()
+            raise ValueError('Token stream files can only be mapped on little-endian machines')
+
+        kinds_at, starts_at, ends_at, values_at, index_at, pool_at = sections
+        view = memoryview(self.data)
+        offset_type = 'I' if width == 4 else 'Q'
+        self.count = count
+        self.kinds = view[kinds_at:kinds_at + count]
+        self.starts = view[starts_at:starts_at + count * width].cast(offset_type)
+        self.ends = view[ends_at:ends_at + count * width].cast(offset_type)
+        self.value_ids = view[values_at:values_at + count * 4].cast('I')
+        self.pool_index = view[index_at:index_at + (self.string_count + 1) * 8].cast('Q')
+        self.pool_at = pool_at
+        self.view = view
+
+    def string(self, string_id):
+        start = self.pool_at + self.pool_index[string_id]
+        end = self.pool_at + self.pool_index[string_id + 1]
+        return str(self.view[start:end], 'utf-8')
+
+    def value(self, index):
+        string_id = self.value_ids[index]
+        return None if string_id == NO_VALUE else self.string(string_id)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('token index out of range')
+        return Token(TokenKind(self.kinds[index]), self.value(index), self.starts[index], self.ends[index])
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def close(self):
+        for name in ('kinds', 'starts', 'ends', 'value_ids', 'pool_index', 'view'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+###############################
+# EXPORTS
+###############################
+
+def export_symbol_table(tokens, path, batch_size=5000, progress=None):
+    # The text symbol table: one repr() line per token. `tokens` is anything
+    # indexable, e.g. a TokenStreamReader. progress(count) is called after every
+    # batch; returning False from it stops the export, and then this returns
+    # False as well.
+    with open(path, 'w') as output_file:
+        for start in range(0, len(tokens), batch_size):
+            stop = min(start + batch_size, len(tokens))
+            output_file.writelines(f"{tokens[index]}\n" for index in range(start, stop))
+            if progress is not None and progress(stop) is False:
+                return False
+    return True
+
+
+def export_symbols(symbols, path):
+    # One line per interned spelling of a SymbolTable: id, kind, spelling,
+    # number of uses and the offset of each use
+    with open(path, 'w') as output_file:
+        for symbol_id, kind, name, offsets in symbols:
+            uses = ' '.join(map(str, offsets))
+            output_file.write(f"{symbol_id}\t{kind.name}\t{name!r}\t{len(offsets)}\t{uses}\n")